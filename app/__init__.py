@@ -1,6 +1,7 @@
 from flask import Flask
 
 from flask_sqlalchemy import SQLAlchemy
+from app.database import engine_options, RoutingSession
 
 app=Flask(__name__)
 
@@ -12,7 +13,78 @@ app.secret_key = os.environ.get("SECRET_KEY",'mjrajrjk294999$(@(@(.)))')
 # environment variable for POSTGRES database url hosted on render. Also a default sqlite db for local users
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL","sqlite:///test.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-db=SQLAlchemy(app)
+# connection pool and timeout settings (see database.py for the environment variables)
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"])
+# optional read replica, used for searches (see read_replica in database.py)
+if os.environ.get("DATABASE_REPLICA_URL"):
+    app.config["SQLALCHEMY_BINDS"] = {"replica": os.environ["DATABASE_REPLICA_URL"]}
+# number of flights shown per page on the homepage and admin panel
+app.config["FLIGHTS_PER_PAGE"] = int(os.environ.get("FLIGHTS_PER_PAGE",50))
+# rows saved per transaction by the bulk flight import (schedule_io.py)
+app.config["IMPORT_CHUNK_SIZE"] = int(os.environ.get("IMPORT_CHUNK_SIZE",1000))
+# recurring schedules (schedules.py): days ahead "flask materialize-schedules" creates flights for,
+# and seconds a worker remembers that a searched day's schedule flights exist
+app.config["SCHEDULE_WINDOW_DAYS"] = int(os.environ.get("SCHEDULE_WINDOW_DAYS",90))
+app.config["SCHEDULE_CHECK_TTL"] = int(os.environ.get("SCHEDULE_CHECK_TTL",300))
+# search results cache (search.py): "memory" (per worker) or "sql" (shared by every worker), entries and seconds kept
+app.config["SEARCH_CACHE"] = os.environ.get("SEARCH_CACHE","memory")
+app.config["SEARCH_CACHE_SIZE"] = int(os.environ.get("SEARCH_CACHE_SIZE",10000))
+app.config["SEARCH_CACHE_TTL"] = int(os.environ.get("SEARCH_CACHE_TTL",300))
+# rendered page cache (pages.py): "memory" or "sql" like SEARCH_CACHE, pages kept and seconds kept
+app.config["PAGE_CACHE"] = os.environ.get("PAGE_CACHE","memory")
+app.config["PAGE_CACHE_SIZE"] = int(os.environ.get("PAGE_CACHE_SIZE",1000))
+app.config["PAGE_CACHE_TTL"] = int(os.environ.get("PAGE_CACHE_TTL",300))
+# seconds browsers and CDNs keep static files requested with their fingerprint (assets.py)
+app.config["STATIC_MAX_AGE"] = int(os.environ.get("STATIC_MAX_AGE",31536000))
+# fare calendar cache: number of routes kept and seconds before an entry is refreshed
+app.config["FARE_CALENDAR_CACHE_SIZE"] = int(os.environ.get("FARE_CALENDAR_CACHE_SIZE",1000))
+app.config["FARE_CALENDAR_TTL"] = int(os.environ.get("FARE_CALENDAR_TTL",600))
+# connecting flight search: max number of stops, connections followed from an airport to each next airport,
+# allowed time between landing and the next flight (minutes), and seconds before the in-memory route graph is
+# rebuilt from the database
+app.config["ROUTING_MAX_STOPS"] = int(os.environ.get("ROUTING_MAX_STOPS",2))
+app.config["ROUTING_BRANCHES"] = int(os.environ.get("ROUTING_BRANCHES",3))
+app.config["MIN_CONNECTION_MINUTES"] = int(os.environ.get("MIN_CONNECTION_MINUTES",60))
+app.config["MAX_CONNECTION_MINUTES"] = int(os.environ.get("MAX_CONNECTION_MINUTES",24*60))
+app.config["ROUTE_GRAPH_TTL"] = int(os.environ.get("ROUTE_GRAPH_TTL",3600))
+# where booking wizard drafts are kept: "sql" (booking_draft table, works with many workers) or "memory" (single process only),
+# and how many seconds an unfinished booking is kept
+app.config["DRAFT_STORE"] = os.environ.get("DRAFT_STORE","sql")
+app.config["DRAFT_TTL"] = int(os.environ.get("DRAFT_TTL",3600))
+# minutes a chosen seat is held for a customer before someone else can take it
+app.config["SEAT_HOLD_MINUTES"] = int(os.environ.get("SEAT_HOLD_MINUTES",15))
+# queries slower than this (seconds) are logged with their SQL, and the token a metrics scraper can use
+app.config["SLOW_QUERY_SECONDS"] = float(os.environ.get("SLOW_QUERY_SECONDS",0.25))
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+# comma separated keys for the agency (bulk booking) api. The api is off when this is empty.
+app.config["AGENCY_API_KEYS"] = [key for key in os.environ.get("AGENCY_API_KEYS","").split(",") if key]
+# booking notifications (notifications.py): where messages go ("stdout" or "file" until a mail/SMS provider is added),
+# worker threads, events claimed per batch, and tries before an event is given up on
+app.config["NOTIFY_SINK"] = os.environ.get("NOTIFY_SINK","stdout")
+app.config["NOTIFY_FILE"] = os.environ.get("NOTIFY_FILE","notifications.log")
+app.config["NOTIFY_WORKERS"] = int(os.environ.get("NOTIFY_WORKERS",4))
+app.config["NOTIFY_BATCH_SIZE"] = int(os.environ.get("NOTIFY_BATCH_SIZE",20))
+app.config["NOTIFY_MAX_ATTEMPTS"] = int(os.environ.get("NOTIFY_MAX_ATTEMPTS",8))
+# admin passwords (auth.py): bcrypt cost, hashing threads and how many more logins can wait for one,
+# and login/create account tries allowed per minute from one IP and for one username
+app.config["BCRYPT_LOG_ROUNDS"] = int(os.environ.get("BCRYPT_LOG_ROUNDS",12))
+app.config["AUTH_HASH_WORKERS"] = int(os.environ.get("AUTH_HASH_WORKERS",2))
+app.config["AUTH_HASH_QUEUE"] = int(os.environ.get("AUTH_HASH_QUEUE",8))
+app.config["LOGIN_RATE_PER_IP"] = int(os.environ.get("LOGIN_RATE_PER_IP",10))
+app.config["LOGIN_RATE_PER_USERNAME"] = int(os.environ.get("LOGIN_RATE_PER_USERNAME",5))
+# archive job (archive.py): flights are archived this many days after they arrive, this many flights per
+# transaction, and "flask archive --loop" runs every ARCHIVE_INTERVAL seconds
+app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS",7))
+app.config["ARCHIVE_BATCH_SIZE"] = int(os.environ.get("ARCHIVE_BATCH_SIZE",200))
+app.config["ARCHIVE_INTERVAL"] = int(os.environ.get("ARCHIVE_INTERVAL",3600))
+# "flask sweep --loop" deletes expired rows (booking drafts, cache entries, seat holds) every SWEEP_INTERVAL seconds
+app.config["SWEEP_INTERVAL"] = int(os.environ.get("SWEEP_INTERVAL",600))
+# flights listed on the admin reports page (the ones with the most revenue)
+app.config["REPORT_FLIGHTS"] = int(os.environ.get("REPORT_FLIGHTS",50))
+# "find my bookings" requests allowed per minute from one IP
+app.config["LOOKUP_RATE_PER_IP"] = int(os.environ.get("LOOKUP_RATE_PER_IP",5))
+# RoutingSession sends reads to the replica when one is set up
+db=SQLAlchemy(app,session_options={"class_":RoutingSession})
 
 
-from app import booking_routes,manage_routes,admin_routes
\ No newline at end of file
+from app import events,metrics,assets,booking_routes,manage_routes,admin_routes,api_routes,cli
\ No newline at end of file
@@ -1,30 +1,22 @@
-from flask import render_template,request,redirect,url_for,flash
+from flask import render_template,request,redirect,url_for,flash,Response,stream_with_context
 from app import app
 
 
-import random # to generate a random booking reference number
-from datetime import datetime # for working with dates and time
-
-# imports for admin user authentication and hashing
-# loginManager only handles when you're logged in/logged out and who the current logged in user is. It stores these in sessions.
-from flask_login import LoginManager
+from datetime import date, datetime, timedelta # for working with dates and time
 
 from flask_login import login_user, logout_user, current_user, login_required
-from flask_bcrypt import Bcrypt # for hashing admin password
-
-from app.models import db,Flight,Admin
 
-# bcrypt for hashing
-bcrypt = Bcrypt(app)
+from app.models import db,Flight,Admin,Schedule
+# hashing and rate limiting for login/create are in auth.py (importing it also sets up bcrypt and the login manager)
+from app.auth import hash_password, check_password, auth_rate_limit, HashingBusy
+from app.search import flight_page, parse_date, parse_time
+from app.seats import SEATS
+from app.schedules import checked_days, drop_unsold_flights, materialize
+from app.schedule_io import ImportFormatError, export_flights, file_format, import_flights, read_rows
+from app.reports import flight_edited, flight_report, month_range, route_report
+from app.database import read_replica
 
-# setting up loginManager (flask-login library)
-login_manager = LoginManager()
-login_manager.init_app(app)
-
-# user loader (from flask-login docs)
-@login_manager.user_loader
-def load_user(user_id):
-    return Admin.query.get(int(user_id))
+import io
 
 # flights can be added/edited/deleted to flights database on this page
 @app.route("/admin",methods=['GET','POST'])
@@ -32,9 +24,9 @@ def admin():
     #  if current user is logged in, we show them the page, otherwise they'll be taken to login page
     if current_user.is_authenticated:
         if request.method=='GET':
-            # get all flights so we can show them on the page
-            all_flights = Flight.query.all()
-            return render_template('admin.html',all_flights=all_flights)
+            # get one page of flights so we can show them on the page
+            all_flights, next_cursor = flight_page(request.args)
+            return render_template('admin.html',all_flights=all_flights,next_cursor=next_cursor)
         elif request.method=='POST':
             # if submit button is clicked, check if cityFrom and cityTo are same.
             if request.form['cityFrom']==request.form['cityTo']:
@@ -50,17 +42,20 @@ def admin():
             
             cityFrom = request.form['cityFrom']
             cityTo = request.form['cityTo']
-            departDate = request.form['departDate']
-            arrivalDate = request.form['arrivalDate']
-            departTime = request.form['departTime']
-            arrivalTime = request.form['arrivalTime']
+            # convert form strings to date/time objects for the Date/Time columns
+            departDate = parse_date(request.form['departDate'])
+            arrivalDate = parse_date(request.form['arrivalDate'])
+            departTime = parse_time(request.form['departTime'])
+            arrivalTime = parse_time(request.form['arrivalTime'])
             fclass = request.form['fclass']
 
             # use calculateDuration function below to calculate difference
             duration=calculateDuration(departDate,departTime,arrivalDate,arrivalTime)
 
             price = request.form['price']
-            new_flight = Flight(cityFrom=cityFrom,cityTo=cityTo,departDate=departDate,arrivalDate=arrivalDate,departTime=departTime,arrivalTime=arrivalTime,duration=duration,fclass=fclass,price=price)
+            # capacity is optional, the default is the size of our seat layout
+            capacity = request.form.get('capacity') or len(SEATS)
+            new_flight = Flight(cityFrom=cityFrom,cityTo=cityTo,departDate=departDate,arrivalDate=arrivalDate,departTime=departTime,arrivalTime=arrivalTime,duration=duration,fclass=fclass,price=price,capacity=capacity)
             db.session.add(new_flight)
             db.session.commit()
             
@@ -76,6 +71,10 @@ def admin():
 @login_required # protects these pages from being accessed by unauthenticated people
 def delete(num):
     flight_to_delete = Flight.query.filter_by(num=num).first()
+    if flight_to_delete and flight_to_delete.schedule_id:
+        # it would be created again from its schedule, the schedule has to be changed instead
+        flash(f"Flight {num} is part of schedule {flight_to_delete.schedule_id}. Change the schedule's days or dates instead.")
+        return redirect(url_for('admin'))
     if flight_to_delete:
         db.session.delete(flight_to_delete)
         db.session.commit()
@@ -84,12 +83,10 @@ def delete(num):
         return "Flight doesn't exist"
     
 # used when creating and editing flights (admin and edit functions/pages).
+# takes date and time objects (the Flight column types).
 def calculateDuration(departDate,departTime,arrivalDate,arrivalTime):
-    depart = departDate + " " + departTime
-    depart = datetime.strptime(depart,"%Y-%m-%d %H:%M")
-
-    arrival = arrivalDate + " " + arrivalTime
-    arrival = datetime.strptime(arrival,"%Y-%m-%d %H:%M")
+    depart = datetime.combine(departDate,departTime)
+    arrival = datetime.combine(arrivalDate,arrivalTime)
 
     duration = arrival-depart
     return duration
@@ -117,17 +114,26 @@ def edit(num):
                 return redirect(url_for('edit',num=num))
             
             # edit database when user submits edit form and checks are done
+            # (old values first, the reports move this flight's bookings to the new route/day/price)
+            old_values=(flight_to_edit.cityFrom,flight_to_edit.cityTo,flight_to_edit.fclass,flight_to_edit.departDate,flight_to_edit.price)
             flight_to_edit.cityFrom=request.form['cityFrom']
             flight_to_edit.cityTo=request.form['cityTo']
-            flight_to_edit.departDate=request.form['departDate']
-            flight_to_edit.arrivalDate=request.form['arrivalDate']
-            flight_to_edit.departTime=request.form['departTime']
-            flight_to_edit.arrivalTime=request.form['arrivalTime']
+            flight_to_edit.departDate=parse_date(request.form['departDate'])
+            flight_to_edit.arrivalDate=parse_date(request.form['arrivalDate'])
+            flight_to_edit.departTime=parse_time(request.form['departTime'])
+            flight_to_edit.arrivalTime=parse_time(request.form['arrivalTime'])
             flight_to_edit.fclass=request.form['fclass']
             flight_to_edit.price=request.form['price']
+            # capacity can't go below the places that are already sold
+            if request.form.get('capacity'):
+                if int(request.form['capacity'])<flight_to_edit.seatsSold:
+                    flash(f"Capacity can't be less than the {flight_to_edit.seatsSold} places already sold.")
+                    return redirect(url_for('edit',num=num))
+                flight_to_edit.capacity=int(request.form['capacity'])
 
             # use calculateDuration function below to calculate difference
             flight_to_edit.duration=calculateDuration(flight_to_edit.departDate,flight_to_edit.departTime,flight_to_edit.arrivalDate,flight_to_edit.arrivalTime)
+            flight_edited(flight_to_edit,old_values)
             
             db.session.commit()
             flash("Changes saved.")
@@ -135,6 +141,133 @@ def edit(num):
     else:
         return "Flight doesn't exist"
 
+# revenue, route demand and load factor for flights departing in one month (?month=2030-01, this month by default).
+# answered from the report tables (reports.py), so it's two small queries however many bookings there are.
+@app.route('/admin/reports')
+@login_required
+@read_replica
+def reports():
+    start, end = month_range(request.args.get('month'))
+    routes = route_report(start, end)
+    totals = {c: sum(getattr(r, c) for r in routes) for c in ('bookings','passengers','revenue')}
+    return render_template('reports.html',month=start.strftime('%Y-%m'),routes=routes,totals=totals,
+                           flights=flight_report(start, end, app.config["REPORT_FLIGHTS"]))
+
+# import a timetable file (CSV or JSON Lines, see schedule_io.py) instead of adding flights one at a time.
+# the upload is read as a stream and saved in chunks, the page shows how many flights were added and the bad rows.
+@app.route('/admin/import',methods=['GET','POST'])
+@login_required
+def import_schedule():
+    if request.method=='GET':
+        return render_template('import.html',report=None)
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash("Please choose a file to import.")
+        return redirect(url_for('import_schedule'))
+    # utf-8-sig skips the byte order mark spreadsheet programs add to csv files
+    stream = io.TextIOWrapper(upload.stream,encoding='utf-8-sig',newline='')
+    try:
+        report = import_flights(read_rows(stream,file_format(upload.filename)),dry_run='dry_run' in request.form)
+    except (ImportFormatError, UnicodeDecodeError) as e:
+        flash(f"Couldn't read {upload.filename}: {e}")
+        return redirect(url_for('import_schedule'))
+    return render_template('import.html',report=report,dry_run='dry_run' in request.form)
+
+# download every flight. The file is streamed while it's read from the database, so it works for any table size.
+# example: /admin/export?format=jsonl
+@app.route('/admin/export')
+@login_required
+def export_schedule():
+    fmt = request.args.get('format','csv')
+    if fmt not in ('csv','jsonl'):
+        return "Unknown format", 400
+    mimetype = 'text/csv' if fmt=='csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_flights(fmt)),mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename=flights.{fmt}"})
+
+# recurring flights (see schedules.py). Flights are created from a schedule when they're searched for
+# or by "flask materialize-schedules", so one schedule replaces a flight per day.
+@app.route('/admin/schedules',methods=['GET','POST'])
+@login_required
+def schedules():
+    if request.method=='GET':
+        return render_template('schedules.html',schedules=Schedule.query.order_by(Schedule.cityFrom,Schedule.cityTo,Schedule.departTime).all())
+    schedule = Schedule()
+    error = update_schedule(schedule,request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('schedules'))
+    db.session.add(schedule)
+    db.session.commit()
+    schedule_saved(schedule)
+    flash("Schedule added successfully.")
+    return redirect(url_for('schedules'))
+
+# a timetable change is one edit here: upcoming flights of the schedule that have no bookings are replaced
+# by flights with the new times/price/days. Flights that already have bookings keep their old details.
+@app.route('/admin/schedules/edit/<int:schedule_id>',methods=['GET','POST'])
+@login_required
+def edit_schedule(schedule_id):
+    schedule = db.session.get(Schedule,schedule_id)
+    if not schedule:
+        return "Schedule doesn't exist"
+    if request.method=='GET':
+        return render_template('edit-schedule.html',schedule=schedule)
+    error = update_schedule(schedule,request.form)
+    if error:
+        flash(error)
+        return redirect(url_for('edit_schedule',schedule_id=schedule_id))
+    drop_unsold_flights(schedule.id)
+    db.session.commit()
+    schedule_saved(schedule)
+    flash("Changes saved.")
+    return redirect(url_for('schedules'))
+
+# flights of a deleted schedule that have bookings stay (as normal flights), the rest are removed
+@app.route('/admin/schedules/delete/<int:schedule_id>')
+@login_required
+def delete_schedule(schedule_id):
+    schedule = db.session.get(Schedule,schedule_id)
+    if not schedule:
+        return "Schedule doesn't exist"
+    drop_unsold_flights(schedule.id,unlink=True)
+    db.session.delete(schedule)
+    db.session.commit()
+    flash("Schedule deleted.")
+    return redirect(url_for('schedules'))
+
+# set the schedule's fields from the schedule form. Returns an error message, or None if the form is fine.
+def update_schedule(schedule,form):
+    if form['cityFrom']==form['cityTo']:
+        return "From and to cities must be different."
+    validFrom, validTo = parse_date(form['validFrom']), parse_date(form['validTo'])
+    departTime, arrivalTime = parse_time(form['departTime']), parse_time(form['arrivalTime'])
+    if not (validFrom and validTo and departTime and arrivalTime):
+        return "Please fill in the dates and times."
+    if validFrom>validTo:
+        return "Valid from date must come before valid to date."
+    days = "".join(day for day in "1234567" if day in form.getlist('days'))
+    if not days:
+        return "Choose at least one day of the week."
+    arrivalDays = int(form.get('arrivalDays') or 0)
+    if calculateDuration(validFrom,departTime,validFrom+timedelta(days=arrivalDays),arrivalTime)<=timedelta(0):
+        return "Arrival must be after departure."
+    schedule.cityFrom=form['cityFrom']
+    schedule.cityTo=form['cityTo']
+    schedule.fclass=form['fclass']
+    schedule.price=int(form['price'])
+    schedule.capacity=int(form.get('capacity') or len(SEATS))
+    schedule.departTime, schedule.arrivalTime, schedule.arrivalDays = departTime, arrivalTime, arrivalDays
+    schedule.daysOfWeek, schedule.validFrom, schedule.validTo = days, validFrom, validTo
+    return None
+
+# searches in this worker check the schedules again, and the next days' flights are created straight away
+# so they show up in listings (searches further ahead create their own)
+def schedule_saved(schedule):
+    checked_days.clear()
+    materialize(date.today(),date.today()+timedelta(days=app.config["SCHEDULE_WINDOW_DAYS"]),
+                route=(schedule.cityFrom,schedule.cityTo,schedule.fclass))
+
 # create new admin account
 @app.route('/admin/create',methods=['GET','POST'])
 def create():
@@ -150,13 +283,23 @@ def create():
             username=request.form['username']
             password=request.form['password']
 
+            # too many tries from this IP (or for this username), don't even look at the password
+            wait = auth_rate_limit(username)
+            if wait:
+                flash(f"Too many attempts. Please try again in {int(wait)+1} seconds.")
+                return render_template('create.html'), 429
+
             # if username already exists, flash a message and redirect to create account page
             if Admin.query.filter_by(username=username).first():
                 flash("Username already exists")
                 return redirect(url_for('create'))
             
-            # generate hash from password using bcrypt
-            hash = bcrypt.generate_password_hash(password).decode('utf-8')
+            # generate hash from password using bcrypt (on the hashing pool, see auth.py)
+            try:
+                hash = hash_password(password)
+            except HashingBusy:
+                flash("The server is busy. Please try again in a moment.")
+                return render_template('create.html'), 503
             # add new admin to database
             # we store the hash, not the password. So if database is leaked, passwords are safe.
             new_admin = Admin(username=username,hash=hash)
@@ -179,11 +322,21 @@ def login():
         elif request.method=='POST':
             username=request.form['username']
             password=request.form['password']
+            # too many tries from this IP (or for this username), don't even look at the password
+            wait = auth_rate_limit(username)
+            if wait:
+                flash(f"Too many login attempts. Please try again in {int(wait)+1} seconds.")
+                return render_template('login.html'), 429
             # generating hash again and checking doesnt work because bcrypt automatically adds a random salt,so the hashes dont match
             # we need to use check_password_hash instead
             admin = Admin.query.filter_by(username=username).first()
             # check if user provided password's hash and database stored hash matches
-            if admin and bcrypt.check_password_hash(admin.hash,password):
+            try:
+                password_ok = admin is not None and check_password(admin.hash,password)
+            except HashingBusy:
+                flash("The server is busy. Please try again in a moment.")
+                return render_template('login.html'), 503
+            if password_ok:
                 # using built in flask-login library functions to login the admin
                 login_user(admin)
                 flash('Successfully logged in')
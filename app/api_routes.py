@@ -0,0 +1,203 @@
+from flask import request,jsonify,Response
+from app import app
+
+import hashlib
+import json
+
+from app.models import db,Flight
+from app.bookings import create_booking, get_booking, update_booking, cancel_booking, BOOKING_FIELDS, PASSENGER_FIELDS
+from app.database import read_replica
+from app.search import find_flights, parse_date
+from app.seats import SeatUnavailable, FlightFull
+
+# json api for the mobile app and partners (v1). Everything the booking wizard does in 8 pages is one call here,
+# and nothing is kept in the session: every request carries what it needs.
+
+# most bookings accepted in one bulk call, so one request can't hold a huge transaction open
+MAX_BULK_BOOKINGS = 500
+# flexible date searches can cover up to +-14 days. This also bounds the size of a search response
+# (29 days of one route and class), which is built in memory.
+MAX_SEARCH_DAYS = 14
+
+
+# agency integrations send their key in the X-API-Key header. Keys are set in the AGENCY_API_KEYS environment variable.
+# with no keys configured the agency api is switched off.
+def agency_key_valid():
+    keys = app.config["AGENCY_API_KEYS"]
+    return bool(keys) and request.headers.get("X-API-Key") in keys
+
+
+# flight numbers and ids in the json must be ints (true/false are ints to python, but not numbers here)
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# the flight numbers a booking from the json body uses, to look them up in one query before checking it
+def booking_flight_nums(item):
+    if not isinstance(item, dict):
+        return set()
+    return {item.get(key) for key in ('depart_flight_num','return_flight_num') if is_int(item.get(key))}
+
+
+# booking fields saved as text, anything else in them would only fail in the database
+TEXT_FIELDS = ('meal','seat','email','phone')
+
+# returns a list of problems with one booking from the json body (empty list if it's fine)
+def booking_errors(item, flight_nums):
+    if not isinstance(item, dict):
+        return ["booking must be an object"]
+    errors = [f"{field} is required" for field in BOOKING_FIELDS if not item.get(field)]
+    if errors:
+        return errors
+    errors = [f"{field} must be a string" for field in TEXT_FIELDS if not isinstance(item[field], str)]
+    for key in ('depart_flight_num','return_flight_num'):
+        num = item.get(key)
+        if num is None:
+            continue
+        if not is_int(num):
+            errors.append(f"{key} must be a number")
+        elif num not in flight_nums:
+            errors.append(f"flight {num} doesn't exist")
+    if not isinstance(item['passengers'], list):
+        return errors + ["passengers must be a list"]
+    for i, passenger in enumerate(item['passengers']):
+        if not isinstance(passenger, dict) or any(not passenger.get(field) or not isinstance(passenger[field], str) for field in PASSENGER_FIELDS):
+            errors.append(f"passenger {i} needs {', '.join(PASSENGER_FIELDS)} (as text)")
+    return errors
+
+
+def flight_json(f):
+    return {"num":f.num,"cityFrom":f.cityFrom,"cityTo":f.cityTo,"fclass":f.fclass,"price":f.price,
+            "departDate":f.departDate.isoformat(),"departTime":f.departTime.strftime('%H:%M'),
+            "arrivalDate":f.arrivalDate.isoformat(),"arrivalTime":f.arrivalTime.strftime('%H:%M'),
+            "durationMinutes":int(f.duration.total_seconds()//60),"seatsLeft":f.capacity-f.seatsSold}
+
+def booking_json(booking):
+    return {"id":booking.id,"ref":booking.ref,"meal":booking.meal,"seat":booking.seat,"email":booking.email,"phone":booking.phone,
+            # an admin can delete a flight that still has bookings
+            "depart_flight":flight_json(booking.depart_flight) if booking.depart_flight else None,
+            "return_flight":flight_json(booking.return_flight) if booking.return_flight else None,
+            "passengers":[{"id":p.id,**{field:getattr(p,field) for field in PASSENGER_FIELDS}} for p in booking.passengers]}
+
+
+# flight search, same results as the departure page.
+# example: /api/v1/flights?cityFrom=Sydney&cityTo=Dhaka&departDate=2025-01-31&fclass=Economy&passengers=2&days=3
+# the response is NDJSON (one flight per line). The results are read into memory (they come from the search cache
+# one day at a time), MAX_SEARCH_DAYS keeps them to at most 29 days of flights on one route.
+# the ETag is a hash of the results. Apps polling a search send it back in If-None-Match and get an empty
+# 304 while nothing changed (results come from the search cache, so that costs no flight query).
+@app.route("/api/v1/flights")
+@read_replica
+def api_search_flights():
+    departDate = parse_date(request.args.get("departDate"))
+    missing = [field for field in ("cityFrom","cityTo","fclass") if not request.args.get(field)]
+    if missing or departDate is None:
+        return jsonify({"error":"cityFrom, cityTo, departDate (YYYY-MM-DD) and fclass are required"}), 400
+    try:
+        days = min(max(int(request.args.get("days",0)),0),MAX_SEARCH_DAYS)
+        passengers = max(int(request.args.get("passengers",1)),1)
+    except ValueError:
+        return jsonify({"error":"days and passengers must be numbers"}), 400
+
+    flights = find_flights(request.args["cityFrom"],request.args["cityTo"],departDate,request.args["fclass"],days=days,passengers=passengers)
+    etag = hashlib.sha1(repr(flights).encode()).hexdigest()
+    if request.if_none_match.contains(etag):
+        return Response(status=304,headers={"ETag":f'"{etag}"',"Cache-Control":"no-cache"})
+
+    # no-cache: clients may keep the response, but have to check the ETag before using it again
+    return Response("".join(json.dumps(flight_json(f)) + "\n" for f in flights),
+                    mimetype="application/x-ndjson",headers={"ETag":f'"{etag}"',"Cache-Control":"no-cache"})
+
+
+# one-shot booking: the same json as one item of the bulk call below, saved in one transaction.
+# returns the booking with its id and ref, which are needed to look it up, change or cancel it.
+@app.route("/api/v1/bookings",methods=['POST'])
+def api_create_booking():
+    item = request.get_json(silent=True)
+    nums = booking_flight_nums(item)
+    flight_nums = {num for (num,) in db.session.query(Flight.num).filter(Flight.num.in_(nums))} if nums else set()
+    errors = booking_errors(item, flight_nums)
+    if errors:
+        return jsonify({"error":"invalid booking","errors":errors}), 400
+    try:
+        booking = create_booking(item['depart_flight_num'],item.get('return_flight_num'),item['meal'],item['seat'],
+                                 item['email'],item['phone'],item['passengers'])
+        db.session.commit()
+    except (SeatUnavailable, FlightFull) as e:
+        db.session.rollback()
+        return jsonify({"error":str(e)}), 409
+    return jsonify(booking_json(get_booking(booking.id,booking.ref))), 201
+
+
+# look up, change or cancel a booking. Like the manage and cancel pages, the booking id and ref both have to match
+# (get_booking checks them), otherwise it's a 404 so the api doesn't tell which one was wrong.
+# PATCH body (every key optional): {"meal": "...", "email": "...", "phone": "...", "passengers": [{"id": 1, "fname": "...", "lname": "..."}]}
+@app.route("/api/v1/bookings/<int:booking_id>/<booking_ref>",methods=['GET','PATCH','DELETE'])
+def api_booking(booking_id,booking_ref):
+    booking = get_booking(booking_id,booking_ref)
+    if booking is None:
+        return jsonify({"error":"booking id or reference isn't correct"}), 404
+    if request.method=='GET':
+        return jsonify(booking_json(booking))
+    if request.method=='DELETE':
+        cancel_booking(booking)
+        db.session.commit()
+        return "", 204
+
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return jsonify({"error":"body must be a json object"}), 400
+    errors = [f"{field} must be a string" for field in TEXT_FIELDS if changes.get(field) and not isinstance(changes[field], str)]
+    if errors:
+        return jsonify({"error":"invalid changes","errors":errors}), 400
+    passengers = {p.id: p for p in booking.passengers}
+    names = {}
+    if not isinstance(changes.get("passengers") or [], list):
+        return jsonify({"error":"passengers must be a list"}), 400
+    for p in changes.get("passengers") or []:
+        if not isinstance(p, dict) or not is_int(p.get("id")) or p["id"] not in passengers:
+            return jsonify({"error":"passengers must be objects with the id of a passenger on this booking"}), 400
+        if any(p.get(field) and not isinstance(p[field], str) for field in ("fname","lname")):
+            return jsonify({"error":"passenger names must be strings"}), 400
+        names[p["id"]] = (p.get("fname") or passengers[p["id"]].fname, p.get("lname") or passengers[p["id"]].lname)
+    update_booking(booking,changes.get("meal") or booking.meal,changes.get("email") or booking.email,
+                   changes.get("phone") or booking.phone,names)
+    db.session.commit()
+    return jsonify(booking_json(booking))
+
+
+# create many bookings in one call, for agency integrations.
+# body: {"bookings": [{"depart_flight_num": 1, "return_flight_num": null, "meal": "Halal", "seat": "1A",
+#                      "email": "...", "phone": "...", "passengers": [{"title": "Mr.", "fname": "...", ...}]}, ...]}
+# all bookings are saved in one transaction: either every booking is created or none are.
+@app.route("/api/v1/bookings/bulk",methods=['POST'])
+def bulk_bookings():
+    if not agency_key_valid():
+        return jsonify({"error":"invalid or missing API key"}), 403
+
+    body = request.get_json(silent=True)
+    items = body.get("bookings") if isinstance(body, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error":"bookings must be a non-empty list"}), 400
+    if len(items) > MAX_BULK_BOOKINGS:
+        return jsonify({"error":f"at most {MAX_BULK_BOOKINGS} bookings per call"}), 400
+
+    # check all flight numbers with one query instead of one per booking
+    nums = set().union(*(booking_flight_nums(item) for item in items))
+    flight_nums = {num for (num,) in db.session.query(Flight.num).filter(Flight.num.in_(nums))}
+
+    errors = {i: booking_errors(item, flight_nums) for i, item in enumerate(items)}
+    errors = {i: e for i, e in errors.items() if e}
+    if errors:
+        return jsonify({"error":"invalid bookings","bookings":errors}), 400
+
+    new_bookings = []
+    for i, item in enumerate(items):
+        try:
+            new_bookings.append(create_booking(item['depart_flight_num'],item.get('return_flight_num'),item['meal'],item['seat'],
+                                               item['email'],item['phone'],item['passengers']))
+        except (SeatUnavailable, FlightFull) as e:
+            # one seat is taken or a flight is full, so none of the bookings are saved
+            db.session.rollback()
+            return jsonify({"error":"not enough availability","bookings":{i:[str(e)]}}), 409
+    db.session.commit()
+    return jsonify({"bookings":[{"id":b.id,"ref":b.ref} for b in new_bookings]}), 201
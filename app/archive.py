@@ -0,0 +1,114 @@
+from app import app
+
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from sqlalchemy import and_, delete, insert, or_, select
+
+from app.bookings import PASSENGER_FIELDS, ref_matches
+from app.events import flights_changed
+from app.models import db, ArchivedBooking, ArchivedFlight, Booking, Flight, FlightStats, Passenger, SeatHold, booking_passenger
+from app.search import FlightResult, decode_flight, encode_flight
+
+# departed flights are moved out of the live tables by "flask archive" (see cli.py):
+# - a booking is archived once every flight on it arrived more than ARCHIVE_AFTER_DAYS days ago
+# - a flight is archived at the same time, unless a booking that isn't archived yet still uses it
+#   (the other flight of its round trip hasn't happened yet), then it waits for the next run
+# flights are handled in batches of ARCHIVE_BATCH_SIZE, one transaction each, so the job never holds locks for long.
+# archived bookings are saved with everything the confirmed page shows, so customers can still look at them.
+
+BOOKING_COLUMNS = ("id","ref","meal","seat","email","phone","depart_flight_num","return_flight_num")
+
+
+def compress(value):
+    return zlib.compress(json.dumps(value, default=str).encode("utf-8"))
+
+def decompress(data):
+    return json.loads(zlib.decompress(data))
+
+
+# archive the next batch of departed flights after the (arrivalDate, num) cursor `after`.
+# returns the cursor for the next batch (None when there are no more), and the number of bookings and flights archived.
+def archive_batch(cutoff, after=None, batch_size=None):
+    f, b, p, bp = Flight.__table__, Booking.__table__, Passenger.__table__, booking_passenger
+    query = select(f).where(f.c.arrivalDate < cutoff)
+    if after:
+        arrivalDate, num = after
+        query = query.where(or_(f.c.arrivalDate > arrivalDate, and_(f.c.arrivalDate == arrivalDate, f.c.num > num)))
+    now = datetime.now()
+    with db.engine.begin() as connection:
+        batch = connection.execute(query.order_by(f.c.arrivalDate, f.c.num).limit(batch_size or app.config["ARCHIVE_BATCH_SIZE"])).all()
+        if not batch:
+            return None, 0, 0
+        flights = {row.num: row for row in batch}
+        bookings = connection.execute(select(b).where(or_(b.c.depart_flight_num.in_(flights), b.c.return_flight_num.in_(flights)))).all()
+        # the other flight of a round trip can be in a later batch (or still to come)
+        others = {num for booking in bookings for num in (booking.depart_flight_num, booking.return_flight_num)
+                  if num is not None and num not in flights}
+        if others:
+            flights.update((row.num, row) for row in connection.execute(select(f).where(f.c.num.in_(others))))
+        departed = lambda num: num is None or num not in flights or flights[num].arrivalDate < cutoff
+        done = [booking for booking in bookings if departed(booking.depart_flight_num) and departed(booking.return_flight_num)]
+        done_ids = {booking.id for booking in done}
+        in_use = {num for booking in bookings if booking.id not in done_ids for num in (booking.depart_flight_num, booking.return_flight_num)}
+
+        if done:
+            passengers = {}
+            for row in connection.execute(select(bp.c.booking_id, p).join(p, p.c.id == bp.c.passenger_id).where(bp.c.booking_id.in_(done_ids))):
+                passengers.setdefault(row.booking_id, []).append(row)
+            snapshot = lambda num: encode_flight(FlightResult(**{field: flights[num]._mapping[field] for field in FlightResult._fields})) if num in flights else None
+            connection.execute(insert(ArchivedBooking.__table__), [
+                {"id":booking.id,"ref":booking.ref,"archived":now,"data":compress({
+                    "booking":{column: booking._mapping[column] for column in BOOKING_COLUMNS},
+                    "depart_flight":snapshot(booking.depart_flight_num),
+                    "return_flight":snapshot(booking.return_flight_num),
+                    "passengers":[{field: row._mapping[field] for field in PASSENGER_FIELDS} for row in passengers.get(booking.id, [])],
+                })} for booking in done])
+            connection.execute(delete(bp).where(bp.c.booking_id.in_(done_ids)))
+            connection.execute(delete(p).where(p.c.id.in_([row.id for rows in passengers.values() for row in rows])))
+            connection.execute(delete(b).where(b.c.id.in_(done_ids)))
+
+        archived = [row for row in batch if row.num not in in_use]
+        if archived:
+            nums = [row.num for row in archived]
+            stats = {row.flight_num: row for row in connection.execute(select(FlightStats.__table__).where(FlightStats.flight_num.in_(nums)))}
+            connection.execute(insert(ArchivedFlight.__table__), [
+                {"num":row.num,"cityFrom":row.cityFrom,"cityTo":row.cityTo,"fclass":row.fclass,"departDate":row.departDate,
+                 "bookings":stats[row.num].bookings if row.num in stats else 0,
+                 "passengers":stats[row.num].passengers if row.num in stats else 0,
+                 "revenue":stats[row.num].revenue if row.num in stats else 0,
+                 "archived":now,"data":compress(dict(row._mapping))} for row in archived])
+            connection.execute(delete(SeatHold.__table__).where(SeatHold.flight_num.in_(nums)))
+            connection.execute(delete(FlightStats.__table__).where(FlightStats.flight_num.in_(nums)))
+            connection.execute(delete(f).where(f.c.num.in_(nums)))
+    if archived:
+        # searches for these days (ex: cached before the flights departed) shouldn't show them anymore
+        flights_changed.send(db.session, keys={(row.cityFrom, row.cityTo, row.fclass, row.departDate) for row in archived})
+    return (batch[-1].arrivalDate, batch[-1].num), len(done), len(archived)
+
+
+# archive everything that's due, batch by batch. Returns the numbers of bookings and flights archived.
+def archive(days=None, batch_size=None):
+    cutoff = date.today() - timedelta(days=app.config["ARCHIVE_AFTER_DAYS"] if days is None else days)
+    totals = {"bookings":0,"flights":0}
+    after = None
+    while True:
+        after, bookings, flights = archive_batch(cutoff, after, batch_size)
+        if after is None:
+            return totals
+        totals["bookings"] += bookings
+        totals["flights"] += flights
+
+
+# an archived booking for the confirmed page, or None if there's none with this id or the ref is wrong.
+# it has the same attributes the page uses on a Booking (flights, passengers), and archived is when it was archived.
+def get_archived_booking(booking_id, booking_ref):
+    archived = db.session.get(ArchivedBooking, booking_id)
+    if archived is None or not ref_matches(archived.ref, booking_ref):
+        return None
+    data = decompress(archived.data)
+    return SimpleNamespace(**data["booking"], archived=archived.archived,
+                           depart_flight=decode_flight(data["depart_flight"]) if data["depart_flight"] else None,
+                           return_flight=decode_flight(data["return_flight"]) if data["return_flight"] else None,
+                           passengers=[SimpleNamespace(**p) for p in data["passengers"]])
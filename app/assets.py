@@ -0,0 +1,108 @@
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+from app import app
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+# optional: without the brotli package only .gz files are made (pip install brotli)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# static files (app/static) are served so browsers and CDNs can keep them:
+# - url_for('static', ...) adds a fingerprint of the file's content (?v=<hash>). A request with the current fingerprint
+#   is cached for STATIC_MAX_AGE seconds as immutable, a changed file gets a new url so nobody sees the old one.
+# - without (or with an old) fingerprint, the file is sent with an ETag and checked every time (304 if unchanged)
+# - "flask precompress-static" saves .br/.gz copies of the text files, which are sent to browsers that accept them
+
+# file types worth compressing (images are compressed already)
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt", ".html")
+# Content-Encoding and file suffix, preferred one first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+# filename -> (modification time, fingerprint). The time is checked, so a changed file gets a new fingerprint.
+fingerprints = {}
+
+def fingerprint(filename):
+    path = safe_join(app.static_folder, filename)
+    try:
+        mtime = os.stat(path).st_mtime
+    except (OSError, TypeError):
+        return None
+    cached = fingerprints.get(filename)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    fingerprints[filename] = (mtime, digest)
+    return digest
+
+
+@app.url_defaults
+def add_fingerprint(endpoint, values):
+    if endpoint == "static" and "filename" in values and "v" not in values:
+        digest = fingerprint(values["filename"])
+        if digest:
+            values["v"] = digest
+
+
+# replaces flask's static view
+def send_static(filename):
+    response = None
+    if filename.endswith(COMPRESSIBLE):
+        source = safe_join(app.static_folder, filename)
+        for encoding, suffix in ENCODINGS if source and os.path.isfile(source) else ():
+            path = source + suffix
+            # a copy older than its file is out of date (precompress-static wasn't run after the change)
+            if (encoding in request.accept_encodings and os.path.isfile(path)
+                    and os.path.getmtime(path) >= os.path.getmtime(source)):
+                response = send_from_directory(app.static_folder, filename + suffix,
+                                               mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream")
+                response.content_encoding = encoding
+                break
+        response = response or send_from_directory(app.static_folder, filename)
+        response.vary.add("Accept-Encoding")
+    else:
+        response = send_from_directory(app.static_folder, filename)
+    if request.args.get("v") and request.args["v"] == fingerprint(filename):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config["STATIC_MAX_AGE"]
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+app.view_functions["static"] = send_static
+
+
+# write the .gz (and .br) copies of the compressible static files. Copies that are newer than their file are kept.
+# run it after deploying changed static files (a file is sent uncompressed while its copy is out of date).
+# returns the number of files written.
+def precompress_static():
+    written = 0
+    for folder, _, files in os.walk(app.static_folder):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(folder, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            compressors = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli:
+                compressors[".br"] = lambda data: brotli.compress(data, quality=11)
+            for suffix, compress in compressors.items():
+                if os.path.exists(path + suffix) and os.path.getmtime(path + suffix) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data)
+                # tiny files can get bigger
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+                written += 1
+    return written
@@ -0,0 +1,107 @@
+from flask import request
+from app import app
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import make_transient_to_detached
+
+# imports for admin user authentication and hashing
+# loginManager only handles when you're logged in/logged out and who the current logged in user is. It stores these in sessions.
+from flask_login import LoginManager
+from flask_bcrypt import Bcrypt # for hashing admin password
+
+from app.cache import LRUCache, register_cache
+from app.models import db, Admin
+
+# admin login and password hashing, kept away from customer traffic:
+# - bcrypt runs on a small thread pool, so only AUTH_HASH_WORKERS hashes use CPU at once however many logins come in
+#   (the bcrypt library releases the GIL while hashing, so booking requests keep running meanwhile)
+# - login and create account are rate limited per IP and per username
+# - the logged in admin is cached, so admin pages don't query the admin table on every request
+
+# bcrypt for hashing. The cost (BCRYPT_LOG_ROUNDS) is read from app.config.
+bcrypt = Bcrypt(app)
+
+
+class HashingBusy(Exception):
+    pass
+
+
+# at most AUTH_HASH_WORKERS hashes run at once and AUTH_HASH_QUEUE more can wait. Past that, HashingBusy is
+# raised straight away instead of letting requests pile up behind a flood of logins.
+hash_executor = ThreadPoolExecutor(max_workers=app.config["AUTH_HASH_WORKERS"], thread_name_prefix="bcrypt")
+hash_slots = threading.BoundedSemaphore(app.config["AUTH_HASH_WORKERS"] + app.config["AUTH_HASH_QUEUE"])
+
+def run_hashing(function, *args):
+    if not hash_slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return hash_executor.submit(function, *args).result()
+    finally:
+        hash_slots.release()
+
+def hash_password(password):
+    return run_hashing(bcrypt.generate_password_hash, password).decode('utf-8')
+
+def check_password(hash, password):
+    return run_hashing(bcrypt.check_password_hash, hash, password)
+
+
+# token bucket: every key (an IP or a username) gets `burst` tries, refilled at `per_minute` tries per minute.
+# only the most recently seen keys are kept, so a scan from many IPs can't use up memory.
+# in memory, so with several worker processes each one has its own buckets.
+class RateLimiter:
+    def __init__(self, per_minute, burst, maxsize=10000):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # takes a token for key. Returns 0 if allowed, otherwise the seconds until the next try is allowed.
+    def hit(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+            self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+ip_limiter = RateLimiter(app.config["LOGIN_RATE_PER_IP"], burst=app.config["LOGIN_RATE_PER_IP"])
+username_limiter = RateLimiter(app.config["LOGIN_RATE_PER_USERNAME"], burst=app.config["LOGIN_RATE_PER_USERNAME"])
+
+# seconds this login/create request has to wait, 0 if it can go ahead. Both buckets are charged.
+def auth_rate_limit(username):
+    waits = [ip_limiter.hit(request.remote_addr)]
+    if username:
+        waits.append(username_limiter.hit(username.lower()))
+    return max(waits)
+
+
+# setting up loginManager (flask-login library)
+login_manager = LoginManager()
+login_manager.init_app(app)
+
+# logged in admins, id -> column values. Admins are never edited, only created, so entries only go stale by
+# being deleted from the database by hand, the TTL covers that.
+admin_cache = register_cache("admin_users", LRUCache(maxsize=1000, ttl=300))
+
+# user loader (from flask-login docs), runs on every request from a logged in admin.
+# a cached admin is put back into the session with merge(load=False), which doesn't query the database.
+@login_manager.user_loader
+def load_user(user_id):
+    values = admin_cache.get(user_id)
+    if values is None:
+        admin = db.session.get(Admin, int(user_id))
+        if admin is None:
+            return None
+        admin_cache.set(user_id, {"id":admin.id,"username":admin.username,"hash":admin.hash})
+        return admin
+    admin = Admin(**values)
+    make_transient_to_detached(admin)
+    return db.session.merge(admin, load=False)
@@ -1,18 +1,31 @@
-from flask import render_template,request,session,redirect,url_for,flash
+from flask import render_template,request,session,redirect,url_for,flash,jsonify
 from app import app
 
-import random # to generate a random booking reference number
+from datetime import timedelta
 
-from app.models import db,Flight,Booking, Passenger
+from app.models import db,Flight
+from app.bookings import create_booking, get_booking
+from app.archive import get_archived_booking
+from app.seats import SEAT_ROWS, SEAT_LETTERS, SeatUnavailable, FlightFull, hold_seat, taken_seats
+from app.search import LISTING_ARGS, flight_page, find_flights, parse_date
+from app.fares import fare_calendar, DEFAULT_CALENDAR_DAYS
+from app.routing import find_itineraries, itinerary_summary
+from app.drafts import load_draft, save_draft, clear_draft, draft_required
+from app.database import read_replica
+from app.pages import cached_page
 
 
 @app.route("/",methods=['GET','POST'])
+@read_replica
+@cached_page(flights=True, args=LISTING_ARGS)
 def index():
     if request.method=='GET':
-        all_flights = Flight.query.all()
-        return render_template('index.html',all_flights=all_flights)
+        # only load one page of flights (filters and cursor come from url query parameters)
+        all_flights, next_cursor = flight_page(request.args)
+        return render_template('index.html',all_flights=all_flights,next_cursor=next_cursor)
     elif request.method=='POST':
-        # clear session first to avoid any collisions
+        # clear session and any old booking draft first to avoid any collisions
+        clear_draft()
         session.clear()
 
         # check if cityFrom and cityTo is same.
@@ -27,92 +40,174 @@ def index():
             flash("Depart date must come before return date.")
             return redirect(url_for('index'))
         
-        # after checking, save to session
-        session['cityFrom'] = request.form['cityFrom']
-        session['cityTo'] = request.form['cityTo']
-        session['departDate'] = request.form['departDate']
-        session['returnDate'] = request.form['returnDate']
-        session['fclass'] = request.form['fclass']
-        session['passenger_num'] = int(request.form['passenger_num'])
+        # after checking, save to a new booking draft (kept on the server, see drafts.py)
+        draft = {}
+        draft['cityFrom'] = request.form['cityFrom']
+        draft['cityTo'] = request.form['cityTo']
+        draft['departDate'] = request.form['departDate']
+        draft['returnDate'] = request.form['returnDate']
+        draft['fclass'] = request.form['fclass']
+        draft['passenger_num'] = int(request.form['passenger_num'])
+        save_draft(draft)
         # send user to departure page with url query parameters
         return redirect(url_for('departure'))
     
 @app.route("/departure")
+@read_replica
+@draft_required
 def departure():
+    draft = load_draft()
     # query flights database and show flights that match
-    matching_flights = Flight.query.filter_by(cityFrom=session['cityFrom'],cityTo=session['cityTo'],departDate=session['departDate'],fclass=session['fclass']).all()
+    # only flights with enough places left for every passenger are shown
+    matching_flights = find_flights(draft['cityFrom'],draft['cityTo'],draft['departDate'],draft['fclass'],passengers=draft['passenger_num'])
     if matching_flights:
         return render_template('departure.html',matching_flights=matching_flights)
     else:
         flash("Sorry, no departure flight found. Change your search or create your own flight in admin panel.")
+        flash_nearby_dates(draft['cityFrom'],draft['cityTo'],draft['departDate'],draft['fclass'])
         return redirect(url_for('index'))
     
 @app.route("/return-flight")
+@read_replica
+@draft_required
 def return_flight():
+    draft = load_draft()
     # flip cityTo and cityFrom
-    cityTo = session['cityFrom'] 
-    cityFrom = session['cityTo'] 
-    returnDate=session['returnDate']
-    fclass=session['fclass']
+    cityTo = draft['cityFrom'] 
+    cityFrom = draft['cityTo'] 
+    returnDate=draft['returnDate']
+    fclass=draft['fclass']
     # query flights database and show flights that match
     # this flight will depart on the user selected return date
-    matching_flights = Flight.query.filter_by(cityFrom=cityFrom,cityTo=cityTo,departDate=returnDate,fclass=fclass).all()
+    matching_flights = find_flights(cityFrom,cityTo,returnDate,fclass,passengers=draft['passenger_num'])
     if matching_flights:
         return render_template('departure.html',matching_flights=matching_flights)
     else:
         flash("Sorry, no return flight found. Change your search or create your own flight in admin panel (for testing).")
+        flash_nearby_dates(cityFrom,cityTo,returnDate,fclass)
         return redirect(url_for('index'))
 
+# when a search finds nothing, suggest the cheapest days around the searched date (from the cached fare calendar)
+# so users don't have to keep guessing dates.
+def flash_nearby_dates(cityFrom,cityTo,departDate,fclass,days=3):
+    departDate = parse_date(departDate)
+    if departDate is None:
+        return
+    calendar = fare_calendar(cityFrom,cityTo,fclass,start=departDate-timedelta(days=days),days=days*2+1)
+    if calendar:
+        nearby = ", ".join(f"{d} (${price})" for d, price in sorted(calendar.items()))
+        flash(f"Flights are available on nearby dates: {nearby}")
+
+# cheapest price per day for a route and class, used for flexible date searches.
+# example: /fare-calendar?cityFrom=Sydney&cityTo=Dhaka&fclass=Economy&start=2025-01-01&days=30
+@app.route("/fare-calendar")
+@read_replica
+def fare_calendar_api():
+    start = parse_date(request.args.get('start'))
+    days = request.args.get('days',DEFAULT_CALENDAR_DAYS,type=int)
+    calendar = fare_calendar(request.args.get('cityFrom'),request.args.get('cityTo'),request.args.get('fclass'),start=start,days=days)
+    # json keys need to be strings
+    return jsonify({d.isoformat(): price for d, price in sorted(calendar.items())})
+
+# direct and connecting itineraries for a route, built from the in-memory route graph (routing.py).
+# example: /connections?cityFrom=Sydney&cityTo=Dhaka&fclass=Economy&date=2025-01-01&max_stops=1&passengers=2
+@app.route("/connections")
+@read_replica
+def connections_api():
+    departDate = parse_date(request.args.get('date'))
+    if departDate is None:
+        return jsonify({"error":"date is required (YYYY-MM-DD)"}), 400
+    max_stops = request.args.get('max_stops',type=int)
+    passengers = request.args.get('passengers',1,type=int)
+    itineraries = find_itineraries(request.args.get('cityFrom'),request.args.get('cityTo'),departDate,request.args.get('fclass'),max_stops,passengers)
+    return jsonify([itinerary_summary(path) for path in itineraries])
+
 # this function saves both selected departing and returning flight. Saves space rather than having 2 separate functions
 @app.route("/save_flight/<int:num>")
+@draft_required
 def save_flight(num):
+    draft = load_draft()
     # first figure out if it is depart or return flight
-    # if session['num'] exists, departing flight has been selected, so we book return flight 
-    if 'num' in session:
-        session['return_num'] = num
-    # if session['num'] doesn't exist, departing flight has not been selected, so we book departing flight first 
+    # if draft['num'] exists, departing flight has been selected, so we book return flight 
+    if 'num' in draft:
+        draft['return_num'] = num
+        save_draft(draft)
+    # if draft['num'] doesn't exist, departing flight has not been selected, so we book departing flight first 
     else:
-        session['num'] = num
-        if session['returnDate']!="":
+        draft['num'] = num
+        save_draft(draft)
+        if draft['returnDate']!="":
             # if there's a return date, take them to select return flight selection page
             return redirect(url_for('return_flight'))
     # take them to personal details page if return flight has been saved
     return redirect(url_for('personal_details'))
 
 @app.route("/personal-details",methods=['GET','POST'])
+@draft_required
 def personal_details():
-    passenger_num=session['passenger_num']
+    draft = load_draft()
+    passenger_num=draft['passenger_num']
     if request.method=='GET':
         return render_template('personal-details.html',passenger_num=passenger_num)
     elif request.method=='POST':
-        # if user submits, save info to session
-        # loop to go through multiple passengers
+        # if user submits, save info to the draft
+        # loop to go through multiple passengers, each passenger is saved as a dict in a list
+        passengers = []
         for p in range(passenger_num):
             p = str(p)
-            session['title'+p] = request.form['title'+p]
-            session['fname'+p] = request.form['fname'+p] 
-            session['lname'+p] = request.form['lname'+p] 
-            session['nationality'+p] = request.form['nationality'+p] 
-            session['gender'+p] = request.form['gender'+p] 
-
-        session['email'] = request.form['email']
-        session['phone'] = request.form['phone']
+            passengers.append({
+                'title': request.form['title'+p],
+                'fname': request.form['fname'+p],
+                'lname': request.form['lname'+p],
+                'nationality': request.form['nationality'+p],
+                'gender': request.form['gender'+p],
+            })
+        draft['passengers'] = passengers
+        draft['email'] = request.form['email']
+        draft['phone'] = request.form['phone']
+        save_draft(draft)
         # redirect to next page of wizard
         return redirect(url_for("seat",chosenSeat='NA'))
 
-# we currently only have 1 type of plane, so 1 seat layout.
+# flights in the draft (depart, and return if it's a round trip). The chosen seat is used on all of them.
+def draft_flight_nums(draft):
+    return [num for num in (draft.get('num'),draft.get('return_num')) if num is not None]
+
+# we currently only have 1 type of plane, so 1 seat layout (see seats.py).
 # when we have multiple planes, seat info needs to be stored in a new plane table.
-# we currently don't verify seat selection in database. This means 2 people can book the same seat on the same flight. This needs to be fixed in future updates.
+# seats are checked against the flight's seat inventory: a chosen seat is held for the customer while they finish
+# booking and sold when they pay, so 2 people can't book the same seat on the same flight.
 @app.route("/seat")
+@draft_required
 def seat():
     # seat selection url paramter is sent by JavaScript (seat.js)
     chosenSeat = request.args['chosenSeat']
-    return render_template('seat.html',chosenSeat=chosenSeat)
+    flight_nums = ",".join(str(num) for num in draft_flight_nums(load_draft()))
+    return render_template('seat.html',chosenSeat=chosenSeat,rows=SEAT_ROWS,letters=SEAT_LETTERS,flight_nums=flight_nums)
+
+# seats that can't be chosen on one or more flights, fetched by seat.js in one call.
+# example: /seat-availability?flights=1,2 returns {"taken": ["1A", "3C"]}
+# seats held by the current customer are not counted as taken.
+@app.route("/seat-availability")
+def seat_availability():
+    try:
+        flight_nums = [int(num) for num in request.args.get('flights','').split(',') if num]
+    except ValueError:
+        return jsonify({"error":"flights must be a comma separated list of flight numbers"}), 400
+    return jsonify({"taken":taken_seats(flight_nums,session.get('draft_id'))})
 
 @app.route("/save-seat/<chosenSeat>")
+@draft_required
 def save_seat(chosenSeat):
-    # save seat to session
-    session['chosenSeat'] = chosenSeat
+    draft = load_draft()
+    # hold the seat on every flight in the booking. If someone else has it, send them back to choose again.
+    for flight_num in draft_flight_nums(draft):
+        if not hold_seat(flight_num,chosenSeat,session['draft_id']):
+            flash(f"Sorry, seat {chosenSeat} is not available. Please choose another seat.")
+            return redirect(url_for('seat',chosenSeat='NA'))
+    # save seat to the draft
+    draft['chosenSeat'] = chosenSeat
+    save_draft(draft)
 
     # redirect to next page
     return redirect(url_for('meal'))
@@ -122,21 +217,26 @@ def meal():
     return render_template('meal.html')
 
 @app.route("/meal/<preference>")
+@draft_required
 def save_meal(preference):
-    # save meal to session
-    session['preference'] = preference.capitalize()
+    # save meal to the draft
+    draft = load_draft()
+    draft['preference'] = preference.capitalize()
+    save_draft(draft)
     # redirect to next page
     return redirect(url_for('payment'))
 
 @app.route("/payment",methods=['GET','POST'])
+@draft_required
 def payment():
+    draft = load_draft()
     if request.method=='GET':
         # get flight info
-        flight_num = session['num']
+        flight_num = draft['num']
         flight = Flight.query.filter_by(num=flight_num).first()
 
-        if session['returnDate'] != "":
-            return_num = session['return_num']
+        if draft['returnDate'] != "":
+            return_num = draft['return_num']
             return_flight = Flight.query.filter_by(num=return_num).first()
         else:
             return_flight=0
@@ -147,55 +247,45 @@ def payment():
         # save to database
         
         # add new booking to database
-        depart_flight_num=session['num']
-        preference = session['preference']
-        chosenSeat = session['chosenSeat']
-        email=session['email']
-        phone=session['phone']
+        depart_flight_num=draft['num']
+        preference = draft['preference']
+        chosenSeat = draft['chosenSeat']
+        email=draft['email']
+        phone=draft['phone']
 
         # if return date was kept empty, return flight number will be 0
-        if session['returnDate'] =="":
+        if draft['returnDate'] =="":
             return_flight_num=None
         else:
-            # if return date wasn't empty, customer will have already selected and saved a return flight number into session, we simply access and store it into a variable
-            return_flight_num=session['return_num']
-
-        booking_ref = random.randint(100,10000)
-        new_booking = Booking(depart_flight_num=depart_flight_num,return_flight_num=return_flight_num,meal=preference,seat=chosenSeat,email=email,phone=phone,ref=booking_ref)
-        db.session.add(new_booking)
-        db.session.commit()
-        passenger_num=session['passenger_num']
-        # list to store all passenger ids so we can add them to booking table
-        # for loop to add all passengers to database
-        for p in range(passenger_num):
-            p=str(p)
-            title= session['title'+p]
-            fname = session['fname'+p]
-            lname = session['lname'+p] 
-            nationality=session['nationality'+p]
-            gender=session['gender'+p]
-            # Note: When primary_key=True and the type is Integer, SQLAlchemy + the database automatically treat it as auto-increment. We don't need to pass in any passenger id
-            new_passenger = Passenger(title=title,fname=fname,lname=lname,nationality=nationality,gender=gender)
-            # video tutorial for many to many relationship: https://www.youtube.com/watch?v=47i-jzrrIGQ
-            # we append the booking into passenger, this automatically updates the association table.
-            new_passenger.booking.append(new_booking)
-            db.session.add(new_passenger)
+            # if return date wasn't empty, customer will have already selected and saved a return flight number into the draft, we simply access and store it into a variable
+            return_flight_num=draft['return_num']
+
+        # booking, passengers, association rows, the seat and the places are saved together with a single commit
+        try:
+            new_booking = create_booking(depart_flight_num,return_flight_num,preference,chosenSeat,email,phone,draft['passengers'],draft_id=session['draft_id'])
             db.session.commit()
+        except SeatUnavailable:
+            # seat hold expired and someone else bought the seat, nothing was saved
+            db.session.rollback()
+            flash(f"Sorry, seat {chosenSeat} was taken while you were booking. Please choose another seat.")
+            return redirect(url_for('seat',chosenSeat='NA'))
+        except FlightFull:
+            # the last places were sold to someone else
+            db.session.rollback()
+            flash("Sorry, this flight sold out while you were booking. Please search again.")
+            return redirect(url_for('index'))
 
-        # clear session after everything has been saved to database
+        # clear draft and session after everything has been saved to database
+        clear_draft()
         session.clear()
         return redirect(url_for('confirmed',booking_id=new_booking.id,booking_ref=new_booking.ref))
 
-@app.route("/confirmed/<int:booking_id>/<int:booking_ref>")
+@app.route("/confirmed/<int:booking_id>/<booking_ref>")
 def confirmed(booking_id,booking_ref):
-    # get the booking, flight and passenger associated with this booking id.
-    booking=Booking.query.filter_by(id=booking_id).first()
-    if booking.ref == booking_ref:
-        depart_flight_num=booking.depart_flight_num
-        depart_flight = Flight.query.filter_by(num=depart_flight_num).first()
-        return_flight_num=booking.return_flight_num
-        return_flight = Flight.query.filter_by(num=return_flight_num).first()
-        passenger_list = booking.passengers
-        return render_template('confirmed.html',booking=booking,depart_flight=depart_flight,return_flight=return_flight,passengers=passenger_list)
+    # get the booking, flights and passengers associated with this booking id (one query for booking + flights, one for passengers).
+    # bookings whose flights departed a while ago have been moved to the archive (see archive.py)
+    booking=get_booking(booking_id,booking_ref) or get_archived_booking(booking_id,booking_ref)
+    if booking:
+        return render_template('confirmed.html',booking=booking,depart_flight=booking.depart_flight,return_flight=booking.return_flight,passengers=booking.passengers)
     else:
-        return "Booking reference number isn't correct."
\ No newline at end of file
+        return "Booking reference number isn't correct."
@@ -0,0 +1,114 @@
+import base64
+import secrets
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import joinedload, selectinload
+
+from app.models import db, Booking, Passenger, booking_passenger
+from app.notifications import queue_event
+from app.reports import count_booking
+from app.seats import sell_seat, sell_places, release_seat, release_places
+
+# keys every passenger dict needs (same as the Passenger columns)
+PASSENGER_FIELDS = ('title','fname','lname','nationality','gender')
+# keys every booking needs, passengers is a list of passenger dicts
+BOOKING_FIELDS = ('depart_flight_num','meal','seat','email','phone','passengers')
+
+
+# 80 random bits as 16 letters/digits (base32, ex: "K7Q2M4XW9PLD3RTA"). With that many possible refs a collision
+# is practically impossible, so there's no check-and-retry loop, the unique index on booking.ref is the safety net.
+def generate_ref():
+    return base64.b32encode(secrets.token_bytes(10)).decode('ascii')
+
+# refs are typed in by customers, ignore case and surrounding spaces
+def normalize_ref(booking_ref):
+    return str(booking_ref).strip().upper()
+
+def ref_matches(ref,booking_ref):
+    return secrets.compare_digest(ref.encode(),normalize_ref(booking_ref).encode())
+
+
+# adds a booking, its passengers and its confirmation notification (see notifications.py) to the session, but doesn't commit.
+# the caller commits once, so the booking, its passengers and the booking_passenger rows are saved in one transaction
+# (all or nothing), and SQLAlchemy sends the passenger and association rows as batched inserts instead of one
+# round trip (and one commit) per passenger.
+# the seat and one place per passenger are sold on the depart (and return) flight, and the booking is added to the
+# reports, in the same transaction.
+# if the seat is gone SeatUnavailable is raised, if the flight is full FlightFull is raised, and the caller should
+# roll back. draft_id is the wizard draft holding the seat (None for api bookings).
+def create_booking(depart_flight_num,return_flight_num,meal,seat,email,phone,passengers,draft_id=None):
+    flights = []
+    for flight_num in (depart_flight_num,return_flight_num):
+        if flight_num is not None:
+            flights.append((flight_num,sell_places(flight_num,len(passengers))))
+            sell_seat(flight_num,seat,draft_id)
+    # revenue/load factor reports (reports.py)
+    count_booking(flights,len(passengers))
+    new_booking = Booking(depart_flight_num=depart_flight_num,return_flight_num=return_flight_num,meal=meal,seat=seat,email=email,phone=phone,ref=generate_ref())
+    db.session.add(new_booking)
+    # setting booking on the passenger fills in the association table (booking_passenger) for us
+    db.session.add_all([Passenger(booking=[new_booking],**{field: p[field] for field in PASSENGER_FIELDS}) for p in passengers])
+    # confirmation email/SMS, sent by the notification worker once this is committed
+    queue_event("booked",new_booking,passengers)
+    return new_booking
+
+
+# get a booking for the booking pages (confirmed, manage, cancel), or None if the id doesn't exist or the ref is wrong.
+# booking.ref is the actual ref, booking_ref is user provided.
+# the flights are joined into the booking query and passengers are loaded with one extra query (selectin),
+# so the page runs 2 queries however many passengers there are, instead of one per flight and per passenger.
+def get_booking(booking_id,booking_ref):
+    booking = Booking.query.options(
+        joinedload(Booking.depart_flight),
+        joinedload(Booking.return_flight),
+        selectinload(Booking.passengers),
+    ).filter_by(id=booking_id).first()
+    if booking and ref_matches(booking.ref,booking_ref):
+        return booking
+    return None
+
+
+# (id, ref) of the bookings with this email that have a passenger with this last name (both ignoring case).
+# one query: ix_booking_email finds the bookings, ix_booking_passenger_booking their passengers.
+def find_bookings(email,lname):
+    return db.session.execute(
+        select(Booking.id, Booking.ref).distinct()
+        .join(booking_passenger, booking_passenger.c.booking_id == Booking.id)
+        .join(Passenger, Passenger.id == booking_passenger.c.passenger_id)
+        .where(func.lower(Booking.email) == email.strip().lower(), func.lower(Passenger.lname) == lname.strip().lower())
+        .order_by(Booking.id)).all()
+
+
+# delete a booking with its passengers and association rows: three DELETE statements, whatever the number
+# of passengers (deleting through the ORM sends one statement per row). Part of the caller's transaction.
+def delete_booking(booking):
+    passenger_ids = [p.id for p in booking.passengers]
+    db.session.execute(delete(booking_passenger).where(booking_passenger.c.booking_id == booking.id))
+    db.session.execute(delete(Passenger).where(Passenger.id.in_(passenger_ids)))
+    db.session.execute(delete(Booking).where(Booking.id == booking.id))
+
+
+# change the details customers can edit (manage page and api). names is {passenger id: (fname, lname)},
+# passengers that aren't in it keep their names. Doesn't commit.
+def update_booking(booking,meal,email,phone,names):
+    for p in booking.passengers:
+        if p.id in names:
+            p.fname, p.lname = names[p.id]
+    booking.meal=meal
+    booking.email=email
+    booking.phone=phone
+    queue_event("modified",booking)
+
+
+# cancel a booking: free the seat and the passengers' places on the booked flights so they can be sold again,
+# take it out of the reports, then delete the booking with its passengers. Part of the caller's transaction.
+def cancel_booking(booking):
+    flights = []
+    for flight_num in (booking.depart_flight_num,booking.return_flight_num):
+        if flight_num is not None:
+            release_seat(flight_num,booking.seat)
+            flight = release_places(flight_num,len(booking.passengers))
+            if flight:
+                flights.append((flight_num,flight))
+    count_booking(flights,len(booking.passengers),sign=-1)
+    queue_event("cancelled",booking)
+    delete_booking(booking)
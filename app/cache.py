@@ -0,0 +1,132 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, CacheEntry
+
+# caches that report their hit/miss counts on /admin/metrics, by name
+caches = {}
+
+
+# small in-process cache with a size limit (least recently used entries are dropped first) and an expiry time.
+# it's shared between request threads, so every access is done under a lock.
+# hits and misses are counted, so we can see if a cache is worth keeping.
+class LRUCache:
+    def __init__(self, maxsize=1024, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            # mark as recently used
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    # drop every entry whose key matches, for caches with several entries per thing that changes
+    def delete_where(self, matches):
+        with self._lock:
+            for key in [key for key in self._data if matches(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# same interface as LRUCache, but entries are kept in the cache_entry table, so every worker process shares them
+# and a delete in one worker is seen by all of them. For multi-worker deployments.
+# keys are strings, values are saved as json (dumps/loads convert values that json can't handle).
+# namespace keeps different caches in the same table apart. Like SQLDraftStore it uses its own connections,
+# so it never commits anything in db.session. Expired rows are ignored and replaced on the next set() of their key,
+# delete_expired_entries ("flask sweep") removes the ones that are never set again.
+class SQLCache:
+    table = CacheEntry.__table__
+
+    def __init__(self, namespace, ttl=600, dumps=json.dumps, loads=json.loads):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.hits = 0
+        self.misses = 0
+
+    def entry_key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key, default=None):
+        with db.engine.connect() as connection:
+            value = connection.execute(select(self.table.c.value).where(
+                self.table.c.key == self.entry_key(key), self.table.c.expires > datetime.now())).scalar()
+        # counters are per process, like the in-memory cache's
+        if value is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return self.loads(value)
+
+    def set(self, key, value, ttl=None):
+        expires = datetime.now() + timedelta(seconds=self.ttl if ttl is None else ttl)
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(delete(self.table).where(self.table.c.key == self.entry_key(key)))
+                connection.execute(insert(self.table).values(key=self.entry_key(key), value=self.dumps(value), expires=expires))
+        except IntegrityError:
+            # another worker saved the same entry at the same time, theirs is just as good
+            pass
+
+    def delete(self, key):
+        with db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.key == self.entry_key(key)))
+
+    def clear(self):
+        with db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.key.startswith(f"{self.namespace}:", autoescape=True)))
+
+    def __len__(self):
+        with db.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(self.table).where(
+                self.table.c.key.startswith(f"{self.namespace}:", autoescape=True), self.table.c.expires > datetime.now())).scalar()
+
+
+# remove the expired rows of every SQLCache (they all share the table), returns how many
+def delete_expired_entries():
+    with db.engine.begin() as connection:
+        return connection.execute(delete(CacheEntry.__table__).where(CacheEntry.__table__.c.expires <= datetime.now())).rowcount
+
+
+def register_cache(name, cache):
+    caches[name] = cache
+    return cache
@@ -0,0 +1,132 @@
+from app import app
+
+import sys
+import time
+import click
+
+from app.archive import archive
+from app.assets import precompress_static
+from app.cache import delete_expired_entries
+from app.drafts import draft_store
+
+from app.notifications import OutboxWorker
+from app.reports import rebuild_reports
+from app.schedules import materialize_window
+from app.seats import delete_expired_holds
+from app.schedule_io import ImportFormatError, export_flights, file_format, import_flights, read_rows
+
+# flask commands, run with "flask <command>" from the project folder (see readme)
+
+
+# example: flask import-flights timetable.csv
+#          flask import-flights timetable.jsonl --dry-run
+@app.cli.command("import-flights")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv","jsonl"]), help="defaults to the file extension")
+@click.option("--chunk-size", type=int, help="rows inserted per transaction")
+@click.option("--dry-run", is_flag=True, help="only check the rows")
+def import_flights_command(path, fmt, chunk_size, dry_run):
+    """Import flights from a CSV or JSON Lines file."""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        try:
+            report = import_flights(read_rows(f, fmt or file_format(path)), chunk_size=chunk_size, dry_run=dry_run)
+        except ImportFormatError as e:
+            raise click.ClickException(str(e))
+    for line_num, message in report["errors"]:
+        click.echo(f"line {line_num}: {message}", err=True)
+    if report["failed"] > len(report["errors"]):
+        click.echo(f"... and {report['failed'] - len(report['errors'])} more errors", err=True)
+    click.echo(f"{'checked' if dry_run else 'imported'} {report['imported']} flights, {report['failed']} rows failed")
+
+
+# example: flask export-flights flights.csv
+#          flask export-flights --format jsonl > flights.jsonl
+@app.cli.command("export-flights")
+@click.argument("path", required=False, type=click.Path(dir_okay=False, writable=True))
+@click.option("--format", "fmt", type=click.Choice(["csv","jsonl"]), help="defaults to the file extension")
+def export_flights_command(path, fmt):
+    """Export every flight as CSV or JSON Lines (to stdout without a path)."""
+    fmt = fmt or file_format(path)
+    out = open(path, "w", newline="", encoding="utf-8") if path else sys.stdout
+    try:
+        for text in export_flights(fmt):
+            out.write(text)
+    finally:
+        if path:
+            out.close()
+
+
+# creates the flights of every recurring schedule for the next SCHEDULE_WINDOW_DAYS days. Safe to run any number of
+# times (ex: daily from cron), only missing flights are created.
+@app.cli.command("materialize-schedules")
+@click.option("--days", type=int, help="days ahead, defaults to SCHEDULE_WINDOW_DAYS")
+def materialize_schedules_command(days):
+    """Create upcoming flights from the recurring schedules."""
+    click.echo(f"created {materialize_window(days)} flights")
+
+
+# sends booking notifications from the outbox until stopped (ctrl+c finishes the batches being sent first).
+# run one or more of these next to the web workers.
+@app.cli.command("notify-worker")
+@click.option("--once", is_flag=True, help="stop when there is nothing left to send")
+def notify_worker_command(once):
+    """Send queued booking notifications."""
+    worker = OutboxWorker()
+    try:
+        worker.run(once=once)
+    except KeyboardInterrupt:
+        pass
+    click.echo(f"sent {worker.sent} notifications, {worker.retried} to retry", err=True)
+
+
+# recalculates the admin report tables from the bookings. Run once after upgrading an existing database
+# (migrate_db.py), after that the booking code keeps them up to date.
+@app.cli.command("rebuild-reports")
+def rebuild_reports_command():
+    """Recalculate the revenue and load factor reports."""
+    click.echo(f"report rebuilt for {rebuild_reports()} flights")
+
+
+# moves departed flights and their bookings to the archive tables (see archive.py).
+# example: flask archive
+#          flask archive --loop    (keeps running, every ARCHIVE_INTERVAL seconds)
+@app.cli.command("archive")
+@click.option("--days", type=int, help="archive flights that arrived more than this many days ago, defaults to ARCHIVE_AFTER_DAYS")
+@click.option("--batch-size", type=int, help="flights archived per transaction")
+@click.option("--loop", is_flag=True, help="keep archiving until stopped")
+def archive_command(days, batch_size, loop):
+    """Move departed flights and their bookings to the archive."""
+    try:
+        while True:
+            totals = archive(days, batch_size)
+            click.echo(f"archived {totals['flights']} flights and {totals['bookings']} bookings")
+            if not loop:
+                break
+            time.sleep(app.config["ARCHIVE_INTERVAL"])
+    except KeyboardInterrupt:
+        pass
+
+
+# deletes expired booking drafts, shared (sql) cache entries and seat holds, which are only ignored (not removed) when they're read.
+# example: flask sweep
+#          flask sweep --loop    (keeps running, every SWEEP_INTERVAL seconds)
+@app.cli.command("sweep")
+@click.option("--loop", is_flag=True, help="keep sweeping until stopped")
+def sweep_command(loop):
+    """Delete expired booking drafts, cache entries and seat holds."""
+    try:
+        while True:
+            click.echo(f"deleted {draft_store.delete_expired()} expired drafts, {delete_expired_entries()} cache entries "
+                       f"and {delete_expired_holds()} seat holds")
+            if not loop:
+                break
+            time.sleep(app.config["SWEEP_INTERVAL"])
+    except KeyboardInterrupt:
+        pass
+
+
+# saves compressed copies of the static css/js/svg files next to them, run it when deploying (see assets.py)
+@app.cli.command("precompress-static")
+def precompress_static_command():
+    """Write gzip (and brotli) copies of the static files."""
+    click.echo(f"wrote {precompress_static()} compressed files")
@@ -0,0 +1,64 @@
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+
+import os
+import sqlite3
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+
+# database engine settings. Imported by app/__init__.py before db is created, so nothing here imports from app.
+
+
+# engine options from environment variables. These apply to the primary database and the read replica.
+# pool_pre_ping checks a connection before using it (so connections dropped by the server don't cause errors),
+# pool_recycle replaces connections older than this many seconds (managed postgres closes idle ones).
+def engine_options(database_url):
+    options = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE",5)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW",10)),
+        "pool_timeout": int(os.environ.get("DB_POOL_TIMEOUT",30)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE",1800)),
+        "pool_pre_ping": True,
+    }
+    if database_url.startswith("sqlite"):
+        # seconds sqlite waits for another connection's write lock before failing with "database is locked"
+        options["connect_args"] = {"timeout": float(os.environ.get("DB_BUSY_TIMEOUT",15))}
+    return options
+
+
+# sqlite settings for every new connection:
+# WAL lets searches read while a booking is being written (without it readers and the writer block each other),
+# synchronous=NORMAL is safe with WAL and saves an fsync on every commit,
+# busy_timeout makes sqlite wait for the write lock instead of failing straight away.
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    busy_timeout = int(float(os.environ.get("DB_BUSY_TIMEOUT",15)) * 1000)
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={busy_timeout}")
+    cursor.close()
+
+
+# db.session class that sends reads to the read replica (DATABASE_REPLICA_URL) in views marked with @read_replica.
+# only SELECTs are sent there. Writes, and anything flushed by the session, always go to the primary.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and has_app_context() and g.get("use_replica") and "replica" in self._db.engines):
+            return self._db.engines["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# for read-only pages (search, listings). Replicas can be slightly behind, so pages that write or need the
+# latest data (payment, manage, seat availability) don't use this.
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.use_replica = True
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,118 @@
+from flask import session, g, flash, redirect, url_for
+from app import app
+
+import json
+import secrets
+from datetime import datetime, timedelta
+from functools import wraps
+from sqlalchemy import delete, insert, select
+
+from app.cache import LRUCache
+from app.models import db, BookingDraft
+
+# the booking wizard (index -> departure -> personal details -> seat -> meal -> payment) used to keep everything
+# in the session cookie, which grew with every passenger. Now the cookie only holds an opaque draft id and the
+# draft itself (a dict) is kept on the server in one of the stores below.
+
+
+# any store with get/set/delete can be used, so a redis-like store can be plugged in by writing a class
+# with these three methods (redis GET / SET key value EX ttl / DEL map onto them directly).
+class DraftStore:
+    def get(self, draft_id):
+        raise NotImplementedError
+
+    def set(self, draft_id, draft, ttl):
+        raise NotImplementedError
+
+    def delete(self, draft_id):
+        raise NotImplementedError
+
+    # remove expired drafts, returns how many. Stores that expire drafts by themselves don't need it.
+    def delete_expired(self):
+        return 0
+
+
+# drafts kept in this process only. Fast, but only works with a single worker process.
+class MemoryDraftStore(DraftStore):
+    def __init__(self, maxsize=10000):
+        self.cache = LRUCache(maxsize=maxsize)
+
+    def get(self, draft_id):
+        draft = self.cache.get(draft_id)
+        # hand out a copy, so changes only count once they are saved with set()
+        return dict(draft) if draft is not None else None
+
+    def set(self, draft_id, draft, ttl):
+        self.cache.set(draft_id, dict(draft), ttl=ttl)
+
+    def delete(self, draft_id):
+        self.cache.delete(draft_id)
+
+
+# drafts kept in the booking_draft table, shared by every worker process.
+# uses its own connection (not db.session), so saving a draft never commits unrelated changes in the request.
+class SQLDraftStore(DraftStore):
+    table = BookingDraft.__table__
+
+    def get(self, draft_id):
+        with db.engine.connect() as connection:
+            data = connection.execute(select(self.table.c.data).where(
+                self.table.c.id == draft_id, self.table.c.expires > datetime.now())).scalar()
+        return json.loads(data) if data else None
+
+    def set(self, draft_id, draft, ttl):
+        with db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == draft_id))
+            connection.execute(insert(self.table).values(id=draft_id, data=json.dumps(draft), expires=datetime.now() + timedelta(seconds=ttl)))
+
+    def delete(self, draft_id):
+        with db.engine.begin() as connection:
+            connection.execute(delete(self.table).where(self.table.c.id == draft_id))
+
+    # expired drafts are only ignored by get(), this removes them ("flask sweep", see cli.py)
+    def delete_expired(self):
+        with db.engine.begin() as connection:
+            return connection.execute(delete(self.table).where(self.table.c.expires <= datetime.now())).rowcount
+
+
+DRAFT_STORES = {"memory": MemoryDraftStore, "sql": SQLDraftStore}
+draft_store = DRAFT_STORES[app.config["DRAFT_STORE"]]()
+
+
+# the current user's draft, loaded once per request. Returns an empty dict if there is no draft (or it expired).
+def load_draft():
+    if "draft" not in g:
+        draft_id = session.get("draft_id")
+        g.draft = (draft_store.get(draft_id) if draft_id else None) or {}
+    return g.draft
+
+def save_draft(draft):
+    if "draft_id" not in session:
+        # random, unguessable id. Knowing it gives access to the draft, like the session cookie did before.
+        session["draft_id"] = secrets.token_urlsafe(16)
+    draft_store.set(session["draft_id"], draft, app.config["DRAFT_TTL"])
+    g.draft = draft
+
+def clear_draft():
+    draft_id = session.pop("draft_id", None)
+    if draft_id:
+        draft_store.delete(draft_id)
+    g.pop("draft", None)
+
+
+# for wizard pages after the search form. If the draft is missing or expired, start again from the homepage
+# instead of failing with a KeyError.
+def draft_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not load_draft():
+            flash("Your booking session has expired. Please search again.")
+            return redirect(url_for("index"))
+        return view(*args, **kwargs)
+    return wrapper
+
+
+# templates (payment page, breadcrumb) read wizard values from draft instead of session
+@app.context_processor
+def inject_draft():
+    return {"draft": load_draft()}
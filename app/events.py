@@ -0,0 +1,49 @@
+from blinker import Namespace
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.models import Flight
+
+# signal sent after a commit that added, edited or deleted flights, or sold or released places on them.
+# receivers get keys=set of (cityFrom, cityTo, fclass, departDate), one for every route/class/day that changed,
+# so caches built from flights (ex: fare calendar, search results) only need to drop the affected entries.
+signals = Namespace()
+flights_changed = signals.signal("flights-changed")
+
+
+def flight_key(flight, old=False):
+    values = []
+    for column in ("cityFrom","cityTo","fclass","departDate"):
+        history = inspect(flight).attrs[column].history
+        # for edited flights, old=True gives the values from before the edit
+        if old and history.deleted:
+            values.append(history.deleted[0])
+        else:
+            values.append(getattr(flight, column))
+    return tuple(values)
+
+
+# collect changed flights on every flush, but only tell the rest of the app once the commit has worked
+@event.listens_for(Session, "after_flush")
+def collect_changed_flights(session, flush_context):
+    keys = session.info.setdefault("changed_flights", set())
+    for flight in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(flight, Flight):
+            keys.add(flight_key(flight))
+            # an edit can move a flight to another route or day, so the old key changed too
+            keys.add(flight_key(flight, old=True))
+
+# for changes made with core statements (UPDATE/DELETE), which the flush events don't see.
+# the keys are sent with the others once the session commits, and forgotten if it rolls back.
+def mark_flights_changed(session, keys):
+    session.info.setdefault("changed_flights", set()).update(keys)
+
+@event.listens_for(Session, "after_commit")
+def send_flights_changed(session):
+    keys = session.info.pop("changed_flights", None)
+    if keys:
+        flights_changed.send(session, keys=keys)
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_flights(session):
+    session.info.pop("changed_flights", None)
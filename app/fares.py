@@ -0,0 +1,53 @@
+from app import app
+
+from datetime import date, timedelta
+from sqlalchemy import func
+
+from app.cache import LRUCache, register_cache
+from app.events import flights_changed
+from app.models import db, Flight
+from app.schedules import ensure_materialized
+
+# the calendar shows up to 60 days, 30 by default
+MAX_CALENDAR_DAYS = 60
+DEFAULT_CALENDAR_DAYS = 30
+
+# one cache entry per window: (cityFrom, cityTo, fclass, start, days), each with its own expiry time.
+# a flight change drops the windows of its route that include the flight's day.
+calendar_cache = register_cache("fare_calendar", LRUCache(maxsize=app.config["FARE_CALENDAR_CACHE_SIZE"], ttl=app.config["FARE_CALENDAR_TTL"]))
+
+
+# cheapest price per day for a route and class, as {date: price}. Days without flights (or only sold out ones) are left out.
+# this is one GROUP BY query, which reads a range of ix_flight_search instead of one query per day.
+def query_fare_calendar(cityFrom, cityTo, fclass, start, days):
+    ensure_materialized(cityFrom, cityTo, fclass, start, start + timedelta(days=days - 1))
+    rows = db.session.query(Flight.departDate, func.min(Flight.price)).filter(
+        Flight.cityFrom == cityFrom,
+        Flight.cityTo == cityTo,
+        Flight.departDate >= start,
+        Flight.departDate < start + timedelta(days=days),
+        Flight.fclass == fclass,
+        # sold out flights don't count
+        Flight.seatsSold < Flight.capacity,
+    ).group_by(Flight.departDate).all()
+    return {departDate: price for departDate, price in rows}
+
+
+def fare_calendar(cityFrom, cityTo, fclass, start=None, days=DEFAULT_CALENDAR_DAYS):
+    start = start or date.today()
+    days = max(1, min(days, MAX_CALENDAR_DAYS))
+    key = (cityFrom, cityTo, fclass, start, days)
+    calendar = calendar_cache.get(key)
+    if calendar is None:
+        calendar = query_fare_calendar(cityFrom, cityTo, fclass, start, days)
+        calendar_cache.set(key, calendar)
+    return calendar
+
+
+# when flights are added/edited/deleted (admin, edit and delete routes), drop the cached calendars for those routes.
+# each worker process has its own cache, the TTL makes sure other workers catch up too.
+@flights_changed.connect
+def invalidate_fare_calendar(sender, keys):
+    calendar_cache.delete_where(lambda key: any(
+        key[:3] == (cityFrom, cityTo, fclass) and key[3] <= departDate < key[3] + timedelta(days=key[4])
+        for cityFrom, cityTo, fclass, departDate in keys))
@@ -1,10 +1,18 @@
 from flask import render_template,request,redirect,url_for,flash
 from app import app
 
-from app.models import db,Booking
+from app.models import db
+from app.auth import RateLimiter
+from app.bookings import get_booking, update_booking, cancel_booking, find_bookings
+from app.notifications import queue_lookup
+from app.archive import get_archived_booking
+from app.pages import cached_page
+
+lookup_limiter = RateLimiter(app.config["LOOKUP_RATE_PER_IP"], burst=app.config["LOOKUP_RATE_PER_IP"])
 
 # this page will ask for booking id and reference number to allow access to booking.
 @app.route("/manage-form", methods=['GET','POST'])
+@cached_page()
 def manage_form():
     if request.method=='GET':
         return render_template('manage-form.html')
@@ -12,50 +20,64 @@ def manage_form():
         booking_id=request.form['booking_id']
         booking_ref=request.form['booking_ref']
         return redirect(url_for('manage',booking_id=booking_id,booking_ref=booking_ref))
-    
-@app.route("/manage/<int:booking_id>/<int:booking_ref>",methods=['GET','POST'])
-def manage(booking_id,booking_ref):
+
+# find my bookings: for customers who lost their booking id or ref. The ids and refs of the bookings with this email
+# and a passenger with this last name are emailed to the booking's email address (through the outbox), never shown
+# on the page, so knowing someone's email and last name isn't enough to open their bookings.
+# the page says the same thing whether bookings were found or not.
+@app.route("/find-bookings", methods=['GET','POST'])
+def find_bookings_form():
     if request.method=='GET':
-        # get the booking
-        booking = Booking.query.filter_by(id=booking_id).first()
-        # booking.ref is the actual ref, booking_ref is user provided. We check if they match.
-        # check if booking actually exists and then check ref
-        if booking and booking.ref == booking_ref:
-            passengers = booking.passengers
-            return render_template('manage.html',booking=booking,passengers=passengers)
+        return render_template('find-bookings.html')
+    if lookup_limiter.hit(request.remote_addr):
+        flash("Too many tries, please wait a minute and try again.")
+        return render_template('find-bookings.html'), 429
+    email=request.form['email']
+    bookings=find_bookings(email,request.form['lname'])
+    if bookings:
+        queue_lookup(email.strip(),bookings)
+        db.session.commit()
+    flash("If we found bookings for these details, we've emailed their ids and references to you.")
+    return redirect(url_for('manage_form'))
+
+# archived bookings (their flights departed, see archive.py) can still be viewed but not changed or cancelled
+def departed_booking(booking_id,booking_ref):
+    flash("This booking's flights have departed, so it can't be changed anymore.")
+    return redirect(url_for('confirmed',booking_id=booking_id,booking_ref=booking_ref))
+
+@app.route("/manage/<int:booking_id>/<booking_ref>",methods=['GET','POST'])
+def manage(booking_id,booking_ref):
+    # get the booking with its flights and passengers.
+    # get_booking checks if booking actually exists and then checks the ref, so both GET and POST are protected.
+    booking = get_booking(booking_id,booking_ref)
+    if booking is None:
+        if get_archived_booking(booking_id,booking_ref):
+            return departed_booking(booking_id,booking_ref)
         flash("Booking id or reference isn't correct")
         return redirect(url_for('manage_form'))
+    if request.method=='GET':
+        passengers = booking.passengers
+        return render_template('manage.html',booking=booking,passengers=passengers)
     elif request.method=='POST':
-        booking = Booking.query.filter_by(id=booking_id).first()
         # get new info from input tags and update table
-        # update passenger rows, need a loop here since we have multiple passengers.
-        passengers = booking.passengers
-        for p in passengers:
-            p.fname=request.form['fname'+str(p.id)]
-            p.lname=request.form['lname'+str(p.id)]
-
-        # update booking table (meal,email,phone)
-        booking.meal=request.form['meal']
-        booking.email=request.form['email']
-        booking.phone=request.form['phone']
+        # every passenger has their own name inputs (fname<id>, lname<id>)
+        names = {p.id: (request.form['fname'+str(p.id)],request.form['lname'+str(p.id)]) for p in booking.passengers}
+        update_booking(booking,request.form['meal'],request.form['email'],request.form['phone'],names)
         db.session.commit()
         # update booking and passenger table details to new info
         flash('Changes saved!')
         return redirect(url_for('manage',booking_id=booking_id,booking_ref=booking_ref))
 
-@app.route("/cancel/<int:booking_id>/<int:booking_ref>")
+@app.route("/cancel/<int:booking_id>/<booking_ref>")
 def cancel(booking_id,booking_ref):
     try:
-        # get the booking
-        booking = Booking.query.filter_by(id=booking_id).first()
-        # booking.ref is the actual ref, booking_ref is user provided. We check if they match.
-        if booking.ref == booking_ref:
-            passengers = booking.passengers
-            # delete booking and associated passenger rows.
-            db.session.delete(booking)
-            # delete from list of passengers
-            for p in passengers:
-                db.session.delete(p)
+        # get the booking (None if id or ref are wrong)
+        booking = get_booking(booking_id,booking_ref)
+        if booking is None and get_archived_booking(booking_id,booking_ref):
+            return departed_booking(booking_id,booking_ref)
+        if booking:
+            # free the seat and places, delete booking, its passenger rows and association rows
+            cancel_booking(booking)
             db.session.commit()
             # after deleting booking, send them to homepage with a flash message.
             flash("Successfully deleted booking and passenger records.")
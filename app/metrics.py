@@ -0,0 +1,159 @@
+from flask import g, request, has_request_context, Response, redirect, url_for, flash
+from flask_login import current_user
+from app import app
+from app.cache import caches
+
+import logging
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger("app.metrics")
+
+# request time buckets in seconds, and buckets for the number of queries in one request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+
+# prometheus style histogram: how many observations were <= each bucket, plus their sum and count.
+# observe() is a few additions under a lock, so it's cheap enough to run on every request.
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    # prometheus buckets are cumulative (each one includes the smaller ones)
+    def lines(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines, running = [], 0
+        for bucket, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {running}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {total}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+        return lines
+
+
+# all metrics live in this process. With several workers each one has its own numbers
+# (prometheus adds them up when every worker is scraped).
+class Metrics:
+    def __init__(self):
+        self.latency = {}
+        self.db_time = {}
+        self.db_queries = {}
+        self.responses = {}
+        self.slow_queries = 0
+        self._lock = threading.Lock()
+
+    def histogram(self, histograms, key, buckets):
+        if key not in histograms:
+            with self._lock:
+                histograms.setdefault(key, Histogram(buckets))
+        return histograms[key]
+
+    def record_request(self, endpoint, method, status, seconds, queries, db_seconds):
+        key = (endpoint, method)
+        self.histogram(self.latency, key, LATENCY_BUCKETS).observe(seconds)
+        self.histogram(self.db_time, key, LATENCY_BUCKETS).observe(db_seconds)
+        self.histogram(self.db_queries, key, QUERY_BUCKETS).observe(queries)
+        with self._lock:
+            self.responses[(endpoint, method, status)] = self.responses.get((endpoint, method, status), 0) + 1
+
+    def record_slow_query(self):
+        with self._lock:
+            self.slow_queries += 1
+
+    # everything in the prometheus text format
+    def render(self):
+        lines = []
+        for name, help_text, histograms in (
+            ("flask_request_duration_seconds", "Time spent handling a request.", self.latency),
+            ("flask_request_db_seconds", "Time spent in database queries per request.", self.db_time),
+            ("flask_request_db_queries", "Number of database queries per request.", self.db_queries),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for (endpoint, method), histogram in sorted(histograms.items()):
+                lines += histogram.lines(name, f'endpoint="{endpoint}",method="{method}"')
+        lines += ["# HELP flask_responses_total Responses sent, by status code.", "# TYPE flask_responses_total counter"]
+        for (endpoint, method, status), count in sorted(self.responses.items()):
+            lines.append(f'flask_responses_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+        lines += ["# HELP sqlalchemy_slow_queries_total Queries slower than SLOW_QUERY_SECONDS.", "# TYPE sqlalchemy_slow_queries_total counter",
+                  f"sqlalchemy_slow_queries_total {self.slow_queries}"]
+        lines += ["# HELP app_cache_hits_total Cache lookups that found an entry.", "# TYPE app_cache_hits_total counter"]
+        lines += [f'app_cache_hits_total{{cache="{name}"}} {cache.hits}' for name, cache in sorted(caches.items())]
+        lines += ["# HELP app_cache_misses_total Cache lookups that found nothing.", "# TYPE app_cache_misses_total counter"]
+        lines += [f'app_cache_misses_total{{cache="{name}"}} {cache.misses}' for name, cache in sorted(caches.items())]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    g.db_queries = 0
+    g.db_seconds = 0.0
+
+def finish_request(status):
+    if "request_start" not in g or g.get("request_recorded"):
+        return
+    g.request_recorded = True
+    # request.endpoint is the view function name, so there's one set of metrics per route (not per url)
+    metrics.record_request(request.endpoint or "unknown", request.method, status,
+                           time.perf_counter() - g.request_start, g.db_queries, g.db_seconds)
+
+@app.after_request
+def record_request(response):
+    finish_request(response.status_code)
+    return response
+
+# after_request doesn't run when a view raises an error, this catches those
+@app.teardown_request
+def record_failed_request(error):
+    if error is not None:
+        finish_request(500)
+
+
+# every query on every engine goes through these two events. They time the query, add it to the current
+# request's totals and log it with its SQL if it was slow.
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_query(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_start"].pop()
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_seconds += seconds
+    if seconds >= app.config["SLOW_QUERY_SECONDS"]:
+        metrics.record_slow_query()
+        # parameters are left out of the log because they can contain customer details
+        logger.warning("Slow query (%.3fs) in %s: %s", seconds, request.endpoint if has_request_context() else "-", statement)
+
+
+# metrics for prometheus. Logged in admins can open it in the browser, a scraper can send
+# "Authorization: Bearer <METRICS_TOKEN>" instead.
+@app.route("/admin/metrics")
+def admin_metrics():
+    token = app.config["METRICS_TOKEN"]
+    if not current_user.is_authenticated and not (token and request.headers.get("Authorization") == f"Bearer {token}"):
+        flash("Please login or create account to access admin panel")
+        return redirect(url_for('login'))
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
@@ -1,5 +1,6 @@
 from app import db
 from flask_login import UserMixin
+from sqlalchemy.schema import CreateIndex
 
 
 # convention class naming is uppercase. However, sqlite stores table name in lowercase
@@ -9,19 +10,71 @@ class Flight(db.Model):
     num = db.Column("num",db.Integer, primary_key=True)
     cityFrom = db.Column("cityFrom",db.String(10), nullable=False)
     cityTo = db.Column("cityTo",db.String(10), nullable=False)
-    departDate=db.Column("departDate",db.String(10), nullable=False)
-    arrivalDate=db.Column("arrivalDate",db.String(10), nullable=False)
-    departTime = db.Column("departTime",db.String(10), nullable=False)
-    arrivalTime= db.Column("arrivalTime",db.String(10), nullable=False)
+    # real Date and Time columns (they used to be strings), so comparisons and date ranges are done by the database correctly.
+    # run migrate_db.py once to convert an existing database.
+    departDate=db.Column("departDate",db.Date, nullable=False)
+    arrivalDate=db.Column("arrivalDate",db.Date, nullable=False)
+    departTime = db.Column("departTime",db.Time, nullable=False)
+    arrivalTime= db.Column("arrivalTime",db.Time, nullable=False)
     # db.Interval is good for storing difference between dates or time. DateTime() is better for specific dates.
     duration= db.Column("duration",db.Interval, nullable=False)
     fclass = db.Column("fclass",db.String(10), nullable=False)
     price= db.Column("price",db.Integer, nullable=False)
+    # sold seats as a bitmap, one bit per seat in the seat layout (see seats.py). 0 means every seat is free.
+    # a bitmap lets a seat be sold with a single atomic UPDATE, so two bookings can't get the same seat.
+    seatMap = db.Column("seatMap",db.BigInteger, nullable=False, default=0, server_default="0")
+    # number of passengers the flight can take and how many places are sold so far.
+    # each flight row is one class (fclass), so this is the capacity of that cabin.
+    # seatsSold is kept up to date by the booking and cancel code, so availability never needs to count bookings.
+    capacity = db.Column("capacity",db.Integer, nullable=False, default=20, server_default="20")
+    seatsSold = db.Column("seatsSold",db.Integer, nullable=False, default=0, server_default="0")
+    # the recurring schedule this flight was created from (see schedules.py), None for flights added one at a time
+    schedule_id = db.Column("schedule_id",db.Integer, db.ForeignKey('schedule.id'), nullable=True)
+
+    # indexes so that listing and searching flights doesn't scan the whole table.
+    # ix_flight_departure matches the order used by the paginated flight listing (see search.py).
+    # ix_flight_search matches the booking search (route + date + class), so a search is an index lookup
+    # and a date range on a route (ex: +-3 days) is a single index range scan.
+    __table_args__ = (
+        db.Index("ix_flight_departure","departDate","departTime","num"),
+        db.Index("ix_flight_search","cityFrom","cityTo","departDate","fclass"),
+        db.Index("ix_flight_class","fclass","departDate","departTime"),
+        # a schedule has at most one flight per day, this also stops two workers creating the same flight
+        db.Index("uq_flight_schedule_date","schedule_id","departDate",unique=True),
+        # the archive job (archive.py) goes through departed flights in this order
+        db.Index("ix_flight_arrival","arrivalDate","num"),
+    )
+
+# a recurring flight: same route, class, times and price on some days of the week between validFrom and validTo.
+# dated Flight rows are created from it when they're needed (see schedules.py), so a daily route for a year is one
+# row here instead of 365 flights entered by hand, and a timetable change is one edit.
+class Schedule(db.Model):
+    id = db.Column("id",db.Integer, primary_key=True)
+    cityFrom = db.Column("cityFrom",db.String(10), nullable=False)
+    cityTo = db.Column("cityTo",db.String(10), nullable=False)
+    fclass = db.Column("fclass",db.String(10), nullable=False)
+    price = db.Column("price",db.Integer, nullable=False)
+    capacity = db.Column("capacity",db.Integer, nullable=False, default=20)
+    departTime = db.Column("departTime",db.Time, nullable=False)
+    arrivalTime = db.Column("arrivalTime",db.Time, nullable=False)
+    # arrival is this many days after departure (1 for an overnight flight)
+    arrivalDays = db.Column("arrivalDays",db.Integer, nullable=False, default=0)
+    # days the flight runs, as weekday numbers (1 = Monday ... 7 = Sunday). example: "135" = Mon, Wed, Fri
+    daysOfWeek = db.Column("daysOfWeek",db.String(7), nullable=False)
+    validFrom = db.Column("validFrom",db.Date, nullable=False)
+    validTo = db.Column("validTo",db.Date, nullable=False)
+
+    __table_args__ = (
+        db.Index("ix_schedule_route","cityFrom","cityTo","fclass"),
+    )
 
 # note: many to many relationships require an association table. Each pssenger can have multiple bookings and each booking can have multiple passengers.
 booking_passenger=db.Table('booking_passenger',
     db.Column('booking_id',db.Integer,db.ForeignKey('booking.id')),
-    db.Column('passenger_id',db.Integer,db.ForeignKey('passenger.id'))
+    db.Column('passenger_id',db.Integer,db.ForeignKey('passenger.id')),
+    # booking -> its passengers (booking pages, find my bookings) and passenger -> their bookings
+    db.Index('ix_booking_passenger_booking','booking_id','passenger_id'),
+    db.Index('ix_booking_passenger_passenger','passenger_id')
 )
 
 class Passenger(db.Model):
@@ -49,14 +102,131 @@ class Booking(db.Model):
     # using 2 foreign key to same key will cause an error here, 
     # we need to specify
     return_flight_num=db.Column(db.Integer,db.ForeignKey('flight.num'),nullable=True) # nullable True because it can be None when there's no return flight
+    # booking.depart_flight / booking.return_flight give the Flight objects.
+    # foreign_keys tells SQLAlchemy which column each relationship uses, since both point to flight.num.
+    # they are loaded lazily by default, pages that show them load them in the same query (see bookings.py).
+    depart_flight=db.relationship('Flight',foreign_keys=[depart_flight_num])
+    return_flight=db.relationship('Flight',foreign_keys=[return_flight_num])
 
     # store booking preferences
     meal=db.Column('meal',db.String(10),nullable=False)
     seat=db.Column('seat',db.String(3),nullable=False)
     email=db.Column('email',db.String(15),nullable=False)
     phone=db.Column('phone',db.String(15),nullable=False)
-    # booking reference (used for verification before viewing and managing and viewing bookings)
-    ref = db.Column('ref',db.Integer,nullable=False)
+    # booking reference (used for verification before viewing and managing and viewing bookings).
+    # random and unique, see generate_ref in bookings.py
+    ref = db.Column('ref',db.String(16),nullable=False,unique=True,index=True)
+
+    # "find my bookings" (bookings.find_bookings) looks bookings up by email, ignoring case. From there it follows
+    # ix_booking_passenger_booking to the passengers, so the last name needs no index of its own.
+    # the flight indexes find the bookings on a flight (archive job, deleting flights)
+    __table_args__ = (
+        db.Index("ix_booking_email",db.func.lower(email)),
+        db.Index("ix_booking_depart_flight","depart_flight_num"),
+        db.Index("ix_booking_return_flight","return_flight_num"),
+    )
+
+# short-lived hold on a seat while a customer finishes the booking wizard (see seats.py).
+# the unique constraint means only one hold can exist per seat on a flight, even with many worker processes.
+class SeatHold(db.Model):
+    __tablename__ = "seat_hold"
+    id = db.Column('id',db.Integer,primary_key=True)
+    flight_num = db.Column('flight_num',db.Integer,db.ForeignKey('flight.num'),nullable=False)
+    seat = db.Column('seat',db.String(3),nullable=False)
+    # the booking draft holding the seat
+    draft_id = db.Column('draft_id',db.String(32),nullable=False,index=True)
+    expires = db.Column('expires',db.DateTime,nullable=False)
+
+    __table_args__ = (db.UniqueConstraint("flight_num","seat",name="uq_seat_hold_seat"),)
+
+# server-side storage for the booking wizard (see drafts.py). data is the draft dict saved as json.
+# expires is indexed so expired drafts can be found and removed quickly.
+class BookingDraft(db.Model):
+    __tablename__ = "booking_draft"
+    id = db.Column('id',db.String(32),primary_key=True)
+    data = db.Column('data',db.Text,nullable=False)
+    expires = db.Column('expires',db.DateTime,nullable=False,index=True)
+
+# notifications waiting to be sent (outbox, see notifications.py). A row is added in the same transaction as the
+# booking change it's about, so a notification is never lost or sent for a change that was rolled back.
+# booking_id is cleared when the booking is deleted, the payload has everything the message needs.
+class OutboxEvent(db.Model):
+    __tablename__ = "outbox_event"
+    id = db.Column('id',db.Integer,primary_key=True)
+    # booked, modified, cancelled or lookup (see notifications.py)
+    kind = db.Column('kind',db.String(20),nullable=False)
+    booking_id = db.Column('booking_id',db.Integer,db.ForeignKey('booking.id',ondelete="SET NULL"),nullable=True)
+    booking = db.relationship('Booking')
+    payload = db.Column('payload',db.Text,nullable=False)
+    created = db.Column('created',db.DateTime,nullable=False)
+    attempts = db.Column('attempts',db.Integer,nullable=False,default=0)
+    # not picked up by a worker before this time (retry backoff, or claimed by a worker that's sending it)
+    next_attempt = db.Column('next_attempt',db.DateTime,nullable=False)
+    sent = db.Column('sent',db.DateTime,nullable=True)
+    # last error, and failed is set when the event ran out of retries
+    error = db.Column('error',db.Text,nullable=True)
+    failed = db.Column('failed',db.Boolean,nullable=False,default=False)
+
+    # workers look for unsent events that are due, in this order
+    __table_args__ = (db.Index("ix_outbox_due","sent","failed","next_attempt"),)
+
+# shared cache entries (see SQLCache in cache.py), used when a cache has to be shared by several worker processes.
+# value is json. Expired rows are skipped when reading and replaced when the entry is set again.
+class CacheEntry(db.Model):
+    __tablename__ = "cache_entry"
+    key = db.Column('key',db.String(255),primary_key=True)
+    value = db.Column('value',db.Text,nullable=False)
+    expires = db.Column('expires',db.DateTime,nullable=False,index=True)
+
+# reporting aggregates (see reports.py), kept up to date by the booking and cancel code and rebuilt by
+# "flask rebuild-reports". revenue is passengers * the flight's price.
+# one row per flight that has ever been booked. departDate is copied here so a month's flights can be found by index.
+class FlightStats(db.Model):
+    __tablename__ = "flight_stats"
+    flight_num = db.Column('flight_num',db.Integer,db.ForeignKey('flight.num',ondelete="CASCADE"),primary_key=True)
+    departDate = db.Column('departDate',db.Date,nullable=False,index=True)
+    bookings = db.Column('bookings',db.Integer,nullable=False,default=0)
+    passengers = db.Column('passengers',db.Integer,nullable=False,default=0)
+    revenue = db.Column('revenue',db.Integer,nullable=False,default=0)
+
+# the same numbers added up per route, class and departure day
+class RouteDayStats(db.Model):
+    __tablename__ = "route_day_stats"
+    cityFrom = db.Column("cityFrom",db.String(10),primary_key=True)
+    cityTo = db.Column("cityTo",db.String(10),primary_key=True)
+    fclass = db.Column("fclass",db.String(10),primary_key=True)
+    day = db.Column('day',db.Date,primary_key=True)
+    bookings = db.Column('bookings',db.Integer,nullable=False,default=0)
+    passengers = db.Column('passengers',db.Integer,nullable=False,default=0)
+    revenue = db.Column('revenue',db.Integer,nullable=False,default=0)
+
+    # reports ask for every route in a date range
+    __table_args__ = (db.Index("ix_route_day_stats_day","day"),)
+
+# departed flights and their bookings are moved out of flight, booking, passenger and booking_passenger into these
+# tables by the archive job (archive.py), so the live tables only hold upcoming flights.
+# data is the compressed json of everything the old row(s) had. Ids are the same as they were in the live tables.
+# a flight keeps its report numbers as columns, so "flask rebuild-reports" can still add them up.
+class ArchivedFlight(db.Model):
+    __tablename__ = "archived_flight"
+    num = db.Column('num',db.Integer,primary_key=True,autoincrement=False)
+    cityFrom = db.Column("cityFrom",db.String(10),nullable=False)
+    cityTo = db.Column("cityTo",db.String(10),nullable=False)
+    fclass = db.Column("fclass",db.String(10),nullable=False)
+    departDate = db.Column('departDate',db.Date,nullable=False)
+    bookings = db.Column('bookings',db.Integer,nullable=False,default=0)
+    passengers = db.Column('passengers',db.Integer,nullable=False,default=0)
+    revenue = db.Column('revenue',db.Integer,nullable=False,default=0)
+    archived = db.Column('archived',db.DateTime,nullable=False)
+    data = db.Column('data',db.LargeBinary,nullable=False)
+
+# a booking with its flights and passengers, so the confirmed page can still show it (read only)
+class ArchivedBooking(db.Model):
+    __tablename__ = "archived_booking"
+    id = db.Column('id',db.Integer,primary_key=True,autoincrement=False)
+    ref = db.Column('ref',db.String(16),nullable=False)
+    archived = db.Column('archived',db.DateTime,nullable=False)
+    data = db.Column('data',db.LargeBinary,nullable=False)
 
 # UserMixin is a helper class provided by Flask-Login that gives your user model all the methods and properties Flask-Login expects.
 # it provides properties like is_authenticated
@@ -64,4 +234,14 @@ class Admin(db.Model,UserMixin):
     id = db.Column('id',db.Integer,primary_key=True)
     username = db.Column('username',db.String(10),nullable=False,unique=True)
     # bcrypt character is 60 characters
-    hash=db.Column('hash',db.String(60),nullable=False)
\ No newline at end of file
+    hash=db.Column('hash',db.String(60),nullable=False)
+
+
+# create_all only creates missing tables, so indexes added to an existing table need to be created separately.
+# IF NOT EXISTS skips indexes that already exist, so this is safe to run again. (checkfirst can't be used:
+# SQLite can't look up expression indexes like ix_booking_email, so they would be created twice.)
+def create_missing_indexes():
+    with db.engine.begin() as connection:
+        for table in db.metadata.tables.values():
+            for index in table.indexes:
+                connection.execute(CreateIndex(index,if_not_exists=True))
@@ -0,0 +1,177 @@
+from app import app
+
+import json
+import logging
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+
+from app.models import db, OutboxEvent
+
+logger = logging.getLogger("app.notifications")
+
+# booking confirmation/change/cancellation messages, sent with the outbox pattern:
+# - the booking code adds an OutboxEvent row in the same transaction as the booking change (queue_event)
+# - a separate worker process ("flask notify-worker") claims due events in batches and sends them with a pool of
+#   threads, retrying failures with a growing delay
+# so a slow or broken mail/SMS provider never slows down or breaks a booking.
+
+# seconds a worker has to send the events it claimed. If it dies, another worker picks them up after this.
+CLAIM_SECONDS = 300
+# delay before retry n is RETRY_BASE_SECONDS * 2^(n-1), at most RETRY_MAX_SECONDS
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# seconds an idle worker waits before looking for new events again
+POLL_SECONDS = 1.0
+
+
+# add a notification about a booking to the session. The caller's commit saves it together with the booking change.
+def queue_event(kind, booking, passengers=None):
+    names = [f"{p['fname']} {p['lname']}" for p in passengers] if passengers is not None else [f"{p.fname} {p.lname}" for p in booking.passengers]
+    payload = {"id":booking.id,"ref":booking.ref,"email":booking.email,"phone":booking.phone,"meal":booking.meal,"seat":booking.seat,
+               "depart_flight_num":booking.depart_flight_num,"return_flight_num":booking.return_flight_num,"passengers":names}
+    now = datetime.now()
+    # a cancelled booking is deleted, so the event isn't linked to it
+    event = OutboxEvent(kind=kind,booking=booking if kind != "cancelled" else None,payload=json.dumps(payload),created=now,next_attempt=now)
+    db.session.add(event)
+    return event
+
+
+# column values of a "lookup" event: an email listing bookings, given as (id, ref) pairs.
+# not linked to one booking. Used by find my bookings and by migrate_db.py when it has to change refs.
+def lookup_event_values(email, bookings):
+    now = datetime.now()
+    payload = {"email":email,"bookings":[{"id":booking_id,"ref":ref} for booking_id, ref in bookings]}
+    return {"kind":"lookup","payload":json.dumps(payload),"created":now,"next_attempt":now,"attempts":0,"failed":False}
+
+def queue_lookup(email, bookings):
+    event = OutboxEvent(**lookup_event_values(email, bookings))
+    db.session.add(event)
+    return event
+
+
+SUBJECTS = {"booked":"Your booking is confirmed","modified":"Your booking has been changed","cancelled":"Your booking has been cancelled",
+            "lookup":"Your bookings"}
+
+# the email and the SMS for one event (lookups only get the email)
+def render_messages(event):
+    payload = json.loads(event.payload)
+    if event.kind == "lookup":
+        lines = "\n".join(f"Booking {b['id']}, reference {b['ref']}" for b in payload["bookings"])
+        return [{"event":event.id,"channel":"email","to":payload["email"],"subject":SUBJECTS[event.kind],
+                 "body":f"These are the bookings we found for your details:\n{lines}"}]
+    # new bookings don't have an id yet when the event is queued, the booking_id column has it after the commit
+    booking_id = event.booking_id or payload["id"]
+    flights = f"flight {payload['depart_flight_num']}" + (f" and return flight {payload['return_flight_num']}" if payload["return_flight_num"] else "")
+    text = f"{SUBJECTS[event.kind]}. Booking {booking_id}, reference {payload['ref']}: {flights}, seat {payload['seat']}."
+    return [
+        {"event":event.id,"channel":"email","to":payload["email"],"subject":SUBJECTS[event.kind],
+         "body":f"{text}\nPassengers: {', '.join(payload['passengers'])}. Meal: {payload['meal']}."},
+        {"event":event.id,"channel":"sms","to":payload["phone"],"body":text},
+    ]
+
+
+# sinks deliver a batch of messages and raise an exception if it failed (then the whole batch is retried).
+# these two stand in for the real mail/SMS provider: a provider sink is a class with the same send() method.
+class StdoutSink:
+    def send(self, messages):
+        sys.stdout.write("".join(json.dumps(m) + "\n" for m in messages))
+        sys.stdout.flush()
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(m) + "\n" for m in messages))
+
+SINKS = {"stdout": lambda: StdoutSink(), "file": lambda: FileSink(app.config["NOTIFY_FILE"])}
+
+
+def retry_delay(attempts):
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS))
+
+
+# drains the outbox. Several workers (threads here, or processes) can run at once: an event is claimed by moving
+# its next_attempt forward with a conditional UPDATE, so only one worker gets it.
+# backpressure: at most 2 batches per thread are claimed and waiting at a time, so a slow sink makes the worker
+# claim less instead of piling up events in memory (unclaimed events wait safely in the table).
+class OutboxWorker:
+    table = OutboxEvent.__table__
+
+    def __init__(self, sink=None, workers=None, batch_size=None, max_attempts=None):
+        self.sink = sink or SINKS[app.config["NOTIFY_SINK"]]()
+        workers = workers or app.config["NOTIFY_WORKERS"]
+        self.batch_size = batch_size or app.config["NOTIFY_BATCH_SIZE"]
+        self.max_attempts = max_attempts or app.config["NOTIFY_MAX_ATTEMPTS"]
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="notify")
+        self.slots = threading.BoundedSemaphore(workers * 2)
+        self.sent = 0
+        self.retried = 0
+        self._lock = threading.Lock()
+
+    # claim up to batch_size due events. Returns the claimed rows (attempts already counts this try).
+    def claim(self):
+        t = self.table
+        now = datetime.now()
+        with db.engine.begin() as connection:
+            ids = connection.execute(select(t.c.id).where(t.c.sent.is_(None), ~t.c.failed, t.c.next_attempt <= now)
+                                     .order_by(t.c.next_attempt, t.c.id).limit(self.batch_size)).scalars().all()
+            if not ids:
+                return []
+            # the conditions are checked again, so events another worker claimed in the meantime are skipped
+            return connection.execute(update(t).where(t.c.id.in_(ids), t.c.sent.is_(None), t.c.next_attempt <= now)
+                                      .values(next_attempt=now + timedelta(seconds=CLAIM_SECONDS), attempts=t.c.attempts + 1)
+                                      .returning(t.c.id, t.c.kind, t.c.booking_id, t.c.payload, t.c.attempts)).all()
+
+    # send one claimed batch (runs on a pool thread)
+    def deliver(self, events):
+        try:
+            with app.app_context():
+                try:
+                    self.sink.send([m for event in events for m in render_messages(event)])
+                except Exception as e:
+                    logger.warning("Sending %d notifications failed: %s", len(events), e)
+                    self.retry(events, e)
+                else:
+                    with db.engine.begin() as connection:
+                        connection.execute(update(self.table).where(self.table.c.id.in_([e.id for e in events])).values(sent=datetime.now()))
+                    with self._lock:
+                        self.sent += len(events)
+        finally:
+            self.slots.release()
+
+    def retry(self, events, error):
+        now = datetime.now()
+        with db.engine.begin() as connection:
+            for event in events:
+                give_up = event.attempts >= self.max_attempts
+                connection.execute(update(self.table).where(self.table.c.id == event.id).values(
+                    error=str(error)[:1000], failed=give_up, next_attempt=now + retry_delay(event.attempts)))
+                if give_up:
+                    logger.error("Giving up on notification %d after %d attempts", event.id, event.attempts)
+        with self._lock:
+            self.retried += len(events)
+
+    # keep claiming and sending batches. once=True stops when nothing is due (and waits for the last batches).
+    def run(self, once=False, stop=None):
+        try:
+            while not (stop and stop.is_set()):
+                # blocks while the pool is full (backpressure)
+                self.slots.acquire()
+                events = self.claim()
+                if not events:
+                    self.slots.release()
+                    if once:
+                        break
+                    time.sleep(POLL_SECONDS)
+                    continue
+                self.executor.submit(self.deliver, events)
+        finally:
+            self.executor.shutdown(wait=True)
+        return self.sent
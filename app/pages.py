@@ -0,0 +1,86 @@
+from flask import make_response, render_template, request, session
+from flask.globals import request_ctx
+from flask_login import current_user
+from markupsafe import Markup
+from app import app
+
+import functools
+import hashlib
+from urllib.parse import urlencode
+
+from app.cache import LRUCache, SQLCache, register_cache
+from app.events import flights_changed
+
+# cache of rendered pages that look the same for every customer (index, manage form).
+# the only parts of these pages that depend on the visitor are the flash messages and the admin links in the
+# navigation bar, so:
+# - a request with flash messages waiting, or one that flashes while rendering, isn't served from or saved to the cache
+# - whether an admin is logged in is part of the cache key
+# only the query arguments a page reads are part of the key, a request with any other argument isn't cached, so made up
+# query strings can't fill the cache. Expired entries of the sql cache are removed by "flask sweep".
+# every cached page is sent with an ETag, so a browser that already has it gets a 304 with no body.
+# pages listing flights (with the seats left) are kept in flight_pages, which is cleared when any flight changes.
+# booking wizard pages (seat, meal, ...) must not use this: their breadcrumb shows the customer's own draft.
+# instead, the parts of them that are the same for everyone (seat grid, meal list) are cached as fragments.
+
+PAGE_CACHES = {
+    "memory": lambda name: LRUCache(maxsize=app.config["PAGE_CACHE_SIZE"], ttl=app.config["PAGE_CACHE_TTL"]),
+    "sql": lambda name: SQLCache(name, ttl=app.config["PAGE_CACHE_TTL"]),
+}
+pages = register_cache("pages", PAGE_CACHES[app.config["PAGE_CACHE"]]("pages"))
+flight_pages = register_cache("flight_pages", PAGE_CACHES[app.config["PAGE_CACHE"]]("flight_pages"))
+fragments = register_cache("fragments", PAGE_CACHES[app.config["PAGE_CACHE"]]("fragments"))
+
+
+# hashed, the query string can be long and the sql cache's keys are at most 255 characters
+def page_key(args):
+    key = f"{request.endpoint}|{urlencode(sorted((k, v) for k, v in request.args.items(multi=True) if k in args))}|{int(current_user.is_authenticated)}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+# decorator for GET pages that can be cached. flights=True for pages that show flights, args are the query
+# arguments the page uses.
+def cached_page(flights=False, args=()):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*view_args, **kwargs):
+            if request.method != "GET" or session.get("_flashes") or any(k not in args for k in request.args):
+                return view(*view_args, **kwargs)
+            cache = flight_pages if flights else pages
+            key = page_key(args)
+            cached = cache.get(key)
+            if cached is None:
+                response = make_response(view(*view_args, **kwargs))
+                # request_ctx.flashes has the messages shown by this page (flashed while it was made)
+                if response.status_code != 200 or response.mimetype != "text/html" or request_ctx.flashes:
+                    return response
+                body = response.get_data(as_text=True)
+                cached = (body, hashlib.sha1(body.encode("utf-8")).hexdigest())
+                cache.set(key, cached)
+            body, etag = cached
+            response = make_response(body)
+            response.set_etag(etag)
+            # browsers keep the page but ask if it changed (If-None-Match) before using it
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+# seats sold, new and edited flights all change the flight listings
+@flights_changed.connect
+def invalidate_flight_pages(sender, keys):
+    flight_pages.clear()
+
+
+# markup of a component template that looks the same for every customer, rendered once and then kept in fragments.
+# used from templates: {{cached_fragment('components/meal-list.html')}}. The template name is the key, so the
+# context given must be the same on every call (constants like the seat layout), never anything from the draft.
+# static file urls in the markup keep their fingerprint until the entry expires (PAGE_CACHE_TTL).
+@app.template_global()
+def cached_fragment(template, **context):
+    html = fragments.get(template)
+    if html is None:
+        html = render_template(template, **context)
+        fragments.set(template, html)
+    return Markup(html)
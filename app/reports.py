@@ -0,0 +1,123 @@
+from datetime import date, timedelta
+from sqlalchemy import delete, func, insert, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.models import db, ArchivedFlight, Booking, Flight, FlightStats, RouteDayStats, booking_passenger
+
+# admin reports (revenue, load factor, route demand) answered from two aggregate tables instead of the bookings:
+# - flight_stats: bookings, passengers and revenue per flight
+# - route_day_stats: the same per route, class and departure day
+# create_booking and cancel_booking add/subtract their booking in the same transaction (count_booking), and admin
+# flight edits move a flight's numbers (flight_edited), so the tables are always up to date. "flask rebuild-reports"
+# recalculates both from the bookings, for existing databases or if they ever drift.
+# archived flights (archive.py) leave flight_stats, route_day_stats keeps their numbers.
+# revenue is passengers * the flight's current price, like the rebuild calculates it.
+
+# INSERT ... ON CONFLICT DO UPDATE, the same for both databases we run on
+UPSERTS = {"sqlite": sqlite.insert, "postgresql": postgresql.insert}
+COUNTS = ("bookings","passengers","revenue")
+
+
+# add to the counts of one aggregate row, creating it if it's missing (other values are set as given).
+# one statement, so bookings racing for the same row can't lose each other's counts.
+def add_counts(model, key, counts, **values):
+    statement = UPSERTS[db.engine.dialect.name](model).values(**key, **values, **counts)
+    db.session.execute(statement.on_conflict_do_update(index_elements=list(key), set_={
+        **{c: statement.excluded[c] for c in values}, **{c: getattr(model, c) + statement.excluded[c] for c in counts}}))
+
+def add_flight(flight_num, flight, bookings, passengers):
+    cityFrom, cityTo, fclass, departDate, price = flight
+    counts = {"bookings":bookings,"passengers":passengers,"revenue":passengers * int(price)}
+    add_counts(FlightStats, {"flight_num":flight_num}, counts, departDate=departDate)
+    add_counts(RouteDayStats, {"cityFrom":cityFrom,"cityTo":cityTo,"fclass":fclass,"day":departDate}, counts)
+
+
+# a booking of `passengers` places on each of flights ((flight_num, row returned by sell_places) pairs) was made,
+# or cancelled with sign=-1. Part of the caller's transaction.
+def count_booking(flights, passengers, sign=1):
+    for flight_num, flight in flights:
+        add_flight(flight_num, flight, sign, sign * passengers)
+
+
+# after an admin edit changed a flight's route, class, day or price: move its numbers from the old
+# (cityFrom, cityTo, fclass, departDate, price) to the flight's new values. Part of the caller's transaction.
+def flight_edited(flight, old):
+    stats = db.session.get(FlightStats, flight.num)
+    new = (flight.cityFrom, flight.cityTo, flight.fclass, flight.departDate, int(flight.price))
+    if stats is None or tuple(old) == new:
+        return
+    bookings, passengers = stats.bookings, stats.passengers
+    add_flight(flight.num, old, -bookings, -passengers)
+    add_flight(flight.num, new, bookings, passengers)
+    # the flight_stats row was changed by core statements, don't let the session write its old values back
+    db.session.expire(stats)
+
+
+# recalculate both tables from the bookings in one transaction. Returns the number of flights with bookings.
+def rebuild_reports():
+    legs = union_all(
+        select(Booking.id.label("booking_id"), Booking.depart_flight_num.label("flight_num")),
+        select(Booking.id, Booking.return_flight_num).where(Booking.return_flight_num.is_not(None)),
+    ).subquery()
+    passenger_counts = (select(booking_passenger.c.booking_id, func.count().label("passengers"))
+                        .group_by(booking_passenger.c.booking_id).subquery())
+    passengers = func.coalesce(passenger_counts.c.passengers, 0)
+    per_flight = (select(Flight.num, Flight.departDate, func.count(), func.sum(passengers), func.sum(passengers * Flight.price))
+                  .select_from(legs).join(Flight, Flight.num == legs.c.flight_num)
+                  .outerjoin(passenger_counts, passenger_counts.c.booking_id == legs.c.booking_id)
+                  .group_by(Flight.num, Flight.departDate))
+    # route_day_stats is added up from the new flight_stats rows and the numbers kept with archived flights (archive.py)
+    flight_rows = union_all(
+        select(Flight.cityFrom, Flight.cityTo, Flight.fclass, FlightStats.departDate.label("day"),
+               FlightStats.bookings, FlightStats.passengers, FlightStats.revenue)
+        .join(Flight, Flight.num == FlightStats.flight_num),
+        select(ArchivedFlight.cityFrom, ArchivedFlight.cityTo, ArchivedFlight.fclass, ArchivedFlight.departDate,
+               ArchivedFlight.bookings, ArchivedFlight.passengers, ArchivedFlight.revenue)
+        .where(ArchivedFlight.bookings != 0),
+    ).subquery()
+    per_route_day = (select(flight_rows.c.cityFrom, flight_rows.c.cityTo, flight_rows.c.fclass, flight_rows.c.day,
+                            *(func.sum(flight_rows.c[c]) for c in COUNTS))
+                     .group_by(flight_rows.c.cityFrom, flight_rows.c.cityTo, flight_rows.c.fclass, flight_rows.c.day))
+    with db.engine.begin() as connection:
+        if connection.dialect.name == "postgresql":
+            # bookings made during the rebuild wait for it, so they're counted exactly once: by the rebuild if they
+            # were committed before it started, otherwise by their own count_booking afterwards.
+            # (SQLite allows one writer at a time, the DELETE below takes that lock before anything is read)
+            connection.execute(text("LOCK TABLE flight_stats, route_day_stats IN EXCLUSIVE MODE"))
+        connection.execute(delete(FlightStats.__table__))
+        connection.execute(delete(RouteDayStats.__table__))
+        connection.execute(insert(FlightStats.__table__).from_select(["flight_num","departDate",*COUNTS], per_flight))
+        connection.execute(insert(RouteDayStats.__table__).from_select(["cityFrom","cityTo","fclass","day",*COUNTS], per_route_day))
+        return connection.execute(select(func.count()).select_from(FlightStats.__table__)).scalar()
+
+
+# bookings, passengers and revenue per route and class for flights departing between start and end (both included),
+# highest revenue first. Reads (routes x days) aggregate rows, however many bookings there are.
+def route_report(start, end):
+    bookings, passengers, revenue = (func.sum(getattr(RouteDayStats, c)).label(c) for c in COUNTS)
+    return db.session.execute(
+        select(RouteDayStats.cityFrom, RouteDayStats.cityTo, RouteDayStats.fclass, bookings, passengers, revenue)
+        .where(RouteDayStats.day.between(start, end))
+        .group_by(RouteDayStats.cityFrom, RouteDayStats.cityTo, RouteDayStats.fclass)
+        .order_by(revenue.desc())).all()
+
+# the flights departing between start and end with the most revenue, with their load factor (places sold / capacity)
+def flight_report(start, end, limit=50):
+    load_factor = (FlightStats.passengers * 1.0 / func.nullif(Flight.capacity, 0)).label("load_factor")
+    return db.session.execute(
+        select(Flight.num, Flight.cityFrom, Flight.cityTo, Flight.fclass, Flight.departDate, Flight.capacity,
+               FlightStats.bookings, FlightStats.passengers, FlightStats.revenue, load_factor)
+        .join(Flight, Flight.num == FlightStats.flight_num)
+        .where(FlightStats.departDate.between(start, end))
+        .order_by(FlightStats.revenue.desc(), Flight.num).limit(limit)).all()
+
+
+# first and last day of the month of a "2030-01" string, this month if it's missing or not a month
+def month_range(month=None):
+    try:
+        year, number = (int(part) for part in month.split("-"))
+        start = date(year, number, 1)
+    except (AttributeError, ValueError):
+        start = date.today().replace(day=1)
+    next_month = (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return start, next_month - timedelta(days=1)
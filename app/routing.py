@@ -0,0 +1,199 @@
+from app import app
+
+import bisect
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, or_, select
+
+from app.events import flights_changed
+from app.models import db, Flight
+
+# one flight in the route graph. Only the columns needed for routing are kept (no ORM objects).
+Leg = namedtuple("Leg", "num cityFrom cityTo fclass departDate depart arrive price places_left")
+
+LEG_COLUMNS = (Flight.num, Flight.cityFrom, Flight.cityTo, Flight.fclass, Flight.departDate,
+               Flight.departTime, Flight.arrivalDate, Flight.arrivalTime, Flight.price, Flight.capacity, Flight.seatsSold)
+
+def make_leg(row):
+    num, cityFrom, cityTo, fclass, departDate, departTime, arrivalDate, arrivalTime, price, capacity, seatsSold = row
+    return Leg(num, cityFrom, cityTo, fclass, departDate,
+               datetime.combine(departDate, departTime), datetime.combine(arrivalDate, arrivalTime), price, capacity - seatsSold)
+
+
+# in-memory route graph for connecting flight searches.
+# adjacency lists are keyed by (city, fclass), because an itinerary keeps the same class on every leg,
+# and every list is sorted by departure time so the flights inside a connection window can be found with bisect.
+# each value is (departure times, legs), both in the same order.
+# lists are never changed in place: updates build a new list and swap it in, so searches running in other
+# threads always see a complete list without needing the lock.
+# only the first search in a process builds the graph itself. After that, changes (flights_changed) and the
+# periodic rebuild are done on a background thread, and searches keep using the current graph meanwhile.
+class RouteGraph:
+    def __init__(self, ttl):
+        # full rebuild after ttl seconds. Other worker processes don't get our flights_changed signal,
+        # so this is what keeps their graphs from going stale.
+        self.ttl = ttl
+        self.adjacency = {}
+        self.built_at = None
+        # flights_changed keys that haven't been applied yet
+        self.pending = set()
+        self.refresh_queued = False
+        self._lock = threading.Lock()
+        self.refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-graph")
+
+    # flights that haven't landed yet, departed flights can't be booked anyway
+    def live_flights(self):
+        return select(*LEG_COLUMNS).where(Flight.arrivalDate >= date.today())
+
+    # rows are read on their own connection, so this works on the refresh thread and right after a commit
+    def load_legs(self, query):
+        with db.engine.connect() as connection:
+            # yield_per streams rows in chunks instead of loading the whole result at once
+            return [make_leg(row) for row in connection.execute(query.execution_options(yield_per=10000))]
+
+    def group_legs(self, legs):
+        grouped = {}
+        for leg in legs:
+            grouped.setdefault((leg.cityFrom, leg.fclass), []).append(leg)
+        return grouped
+
+    def sorted_entry(self, legs):
+        legs = sorted(legs, key=lambda leg: leg.depart)
+        return [leg.depart for leg in legs], legs
+
+    def build(self):
+        with self._lock:
+            # the new graph has every change made before this point
+            self.pending = set()
+        grouped = self.group_legs(self.load_legs(self.live_flights()))
+        adjacency = {city_class: self.sorted_entry(legs) for city_class, legs in grouped.items()}
+        with self._lock:
+            self.adjacency = adjacency
+            self.built_at = time.monotonic()
+
+    # flights_changed: remember the keys and let the refresh thread apply them
+    def mark_changed(self, keys):
+        if self.built_at is None:
+            return
+        with self._lock:
+            self.pending |= set(keys)
+        self.queue_refresh()
+
+    # at most one refresh waits in the queue, it applies every change marked before it starts
+    def queue_refresh(self):
+        with self._lock:
+            if self.refresh_queued:
+                return
+            self.refresh_queued = True
+        self.refresher.submit(self.refresh)
+
+    def refresh(self):
+        with self._lock:
+            self.refresh_queued = False
+        try:
+            with app.app_context():
+                if time.monotonic() - self.built_at > self.ttl:
+                    self.build()
+                else:
+                    self.update()
+        except Exception:
+            app.logger.exception("route graph refresh failed")
+
+    def ensure_built(self):
+        if self.built_at is None:
+            self.build()
+        elif time.monotonic() - self.built_at > self.ttl:
+            self.queue_refresh()
+
+    # incremental update for the pending keys (cityFrom, cityTo, fclass, departDate):
+    # reload only those route/class/day combinations and rebuild the affected adjacency lists.
+    def update(self):
+        with self._lock:
+            keys, self.pending = self.pending, set()
+        if not keys:
+            return
+        conditions = [and_(Flight.cityFrom == cityFrom, Flight.cityTo == cityTo, Flight.fclass == fclass, Flight.departDate == departDate)
+                      for cityFrom, cityTo, fclass, departDate in keys]
+        fresh = self.group_legs(self.load_legs(self.live_flights().where(or_(*conditions))))
+
+        with self._lock:
+            adjacency = dict(self.adjacency)
+            for city_class in {(cityFrom, fclass) for cityFrom, cityTo, fclass, departDate in keys}:
+                # keep legs that weren't touched, replace the ones that were
+                departs, legs = adjacency.get(city_class, ([], []))
+                legs = [leg for leg in legs if (leg.cityFrom, leg.cityTo, leg.fclass, leg.departDate) not in keys]
+                adjacency[city_class] = self.sorted_entry(legs + fresh.get(city_class, []))
+            self.adjacency = adjacency
+
+    # legs leaving city in class fclass between start and end (inclusive) with room for `passengers`
+    def departures(self, city, fclass, start, end, passengers=1):
+        departs, legs = self.adjacency.get((city, fclass), ([], []))
+        return [leg for leg in legs[bisect.bisect_left(departs, start):bisect.bisect_right(departs, end)]
+                if leg.places_left >= passengers]
+
+    # find itineraries from cityFrom to cityTo leaving on departDate, with up to max_stops connections.
+    # a connection is only allowed if the next flight leaves between min_connection and max_connection
+    # after the previous one lands. Results are sorted by arrival time, then total price.
+    # only flights with room for `passengers` are used, and from every airport only the first `branches`
+    # connections to each next airport are followed, so busy hubs don't multiply the search.
+    def search(self, cityFrom, cityTo, departDate, fclass, max_stops, min_connection, max_connection,
+               passengers=1, branches=3, limit=20):
+        self.ensure_built()
+        itineraries = []
+
+        def extend(path):
+            last = path[-1]
+            if last.cityTo == cityTo:
+                itineraries.append(path)
+                return
+            # path has len(path)-1 stops so far, one more leg adds another stop
+            if len(path) > max_stops:
+                return
+            visited = {cityFrom} | {leg.cityTo for leg in path}
+            followed = {}
+            for leg in self.departures(last.cityTo, fclass, last.arrive + min_connection, last.arrive + max_connection, passengers):
+                if leg.cityTo not in visited and followed.get(leg.cityTo, 0) < branches:
+                    followed[leg.cityTo] = followed.get(leg.cityTo, 0) + 1
+                    extend(path + [leg])
+
+        day_start = datetime.combine(departDate, datetime.min.time())
+        for leg in self.departures(cityFrom, fclass, day_start, day_start + timedelta(days=1) - timedelta(microseconds=1), passengers):
+            extend([leg])
+
+        itineraries.sort(key=lambda path: (path[-1].arrive, sum(leg.price for leg in path)))
+        return itineraries[:limit]
+
+
+route_graph = RouteGraph(ttl=app.config["ROUTE_GRAPH_TTL"])
+
+
+# json friendly summary of an itinerary (list of legs)
+def itinerary_summary(path):
+    return {
+        "flights": [leg.num for leg in path],
+        "cities": [path[0].cityFrom] + [leg.cityTo for leg in path],
+        "depart": path[0].depart.isoformat(),
+        "arrive": path[-1].arrive.isoformat(),
+        "duration": str(path[-1].arrive - path[0].depart),
+        "stops": len(path) - 1,
+        "price": sum(leg.price for leg in path),
+    }
+
+
+def find_itineraries(cityFrom, cityTo, departDate, fclass, max_stops=None, passengers=1):
+    max_stops = app.config["ROUTING_MAX_STOPS"] if max_stops is None else min(max_stops, app.config["ROUTING_MAX_STOPS"])
+    return route_graph.search(
+        cityFrom, cityTo, departDate, fclass, max_stops,
+        timedelta(minutes=app.config["MIN_CONNECTION_MINUTES"]),
+        timedelta(minutes=app.config["MAX_CONNECTION_MINUTES"]),
+        passengers=max(passengers, 1), branches=app.config["ROUTING_BRANCHES"],
+    )
+
+
+# keep the graph in sync when flights are added, edited or deleted, or places are sold or released
+@flights_changed.connect
+def update_route_graph(sender, keys):
+    route_graph.mark_changed(keys)
@@ -0,0 +1,192 @@
+from app import app
+
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
+
+from app.models import db, Flight
+from app.events import flights_changed
+from app.search import parse_date, parse_time
+from app.seats import SEATS
+
+# bulk import and export of the flight schedule (CSV or JSON Lines), used by the flask commands in cli.py
+# and the /admin/import and /admin/export pages.
+# files are read and written a chunk at a time, so a season's timetable never has to fit in memory.
+
+# columns in an import file. capacity is optional (defaults to the seat layout size, like the admin form).
+IMPORT_FIELDS = ('cityFrom','cityTo','departDate','departTime','arrivalDate','arrivalTime','fclass','price','capacity')
+EXPORT_FIELDS = ('num','cityFrom','cityTo','departDate','departTime','arrivalDate','arrivalTime','duration','fclass','price','capacity','seatsSold')
+FCLASSES = ('Economy','Business','First')
+# the city and class columns are String(10)
+MAX_NAME_LENGTH = 10
+# price and capacity are Integer columns
+MAX_NUMBER = 2**31 - 1
+# only the first errors are kept in the report, so a completely broken file doesn't use up memory
+MAX_REPORTED_ERRORS = 1000
+
+
+class ImportFormatError(Exception):
+    pass
+
+
+# file format from the file name: .jsonl/.ndjson files are JSON Lines, everything else is CSV
+def file_format(filename):
+    return "jsonl" if filename and filename.lower().endswith((".jsonl",".ndjson")) else "csv"
+
+
+# rows as (line number, dict) from a text stream. Nothing is read until the rows are used.
+def read_rows(stream, fmt="csv"):
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        if reader.fieldnames is None:
+            return
+        missing = [field for field in IMPORT_FIELDS if field != 'capacity' and field not in reader.fieldnames]
+        if missing:
+            raise ImportFormatError(f"Missing columns: {', '.join(missing)}")
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_num, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            # a broken line is reported like any other bad row
+            yield line_num, row if isinstance(row, dict) else {}
+    else:
+        raise ImportFormatError(f"Unknown format: {fmt}")
+
+
+# check one row and convert it to Flight column values. Returns (values, None) or (None, error message).
+# the same checks as the admin form, plus the ones the form's inputs do for us (dates, numbers, class).
+def validate_row(row):
+    values = {field: row.get(field) for field in IMPORT_FIELDS}
+    values = {field: value.strip() if isinstance(value, str) else value for field, value in values.items()}
+    missing = [field for field in IMPORT_FIELDS if field != 'capacity' and values[field] in (None, "")]
+    if missing:
+        return None, f"missing {', '.join(missing)}"
+    # json lines can hold numbers, lists, ... where a csv file only has text
+    if not all(isinstance(values[field], str) for field in ('cityFrom','cityTo','fclass')):
+        return None, "cityFrom, cityTo and fclass must be text"
+    if values['cityFrom'] == values['cityTo']:
+        return None, "from and to cities must be different"
+    if len(values['cityFrom']) > MAX_NAME_LENGTH or len(values['cityTo']) > MAX_NAME_LENGTH:
+        return None, f"city names can be at most {MAX_NAME_LENGTH} characters"
+    if values['fclass'] not in FCLASSES:
+        return None, f"class must be one of {', '.join(FCLASSES)}"
+    for field, parse in (('departDate',parse_date),('arrivalDate',parse_date),('departTime',parse_time),('arrivalTime',parse_time)):
+        parsed = parse(values[field]) if isinstance(values[field], str) else None
+        if parsed is None:
+            return None, f"{field} is not a valid {'date' if 'Date' in field else 'time'}"
+        values[field] = parsed
+    try:
+        values['price'] = whole_number(values['price'])
+        values['capacity'] = whole_number(values['capacity']) if values['capacity'] not in (None, "") else len(SEATS)
+    except (TypeError, ValueError, OverflowError):
+        return None, "price and capacity must be whole numbers"
+    if values['price'] < 0 or values['capacity'] < 1:
+        return None, "price can't be negative and capacity must be at least 1"
+    if values['price'] > MAX_NUMBER or values['capacity'] > MAX_NUMBER:
+        return None, f"price and capacity can be at most {MAX_NUMBER}"
+    return values, None
+
+# "120" from a csv file or 120 from json. Raises ValueError for anything else (12.5, true, 1e400, ...),
+# int() would round floats down and turn true into 1.
+def whole_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(value)
+    return int(value)
+
+
+# durations for a whole chunk in one pass (same result as calculateDuration, without a function call per field).
+# rows where the flight arrives before it departs get None.
+def add_durations(chunk):
+    for values in chunk:
+        duration = datetime.combine(values['arrivalDate'],values['arrivalTime']) - datetime.combine(values['departDate'],values['departTime'])
+        values['duration'] = duration if duration > timedelta(0) else None
+
+
+# import flights from rows (see read_rows). Valid rows are inserted chunk_size at a time with one multi-row
+# INSERT and one commit per chunk, bad rows are skipped and reported with their line number.
+# dry_run only checks the rows.
+# returns {"imported": n, "failed": n, "errors": [(line, message), ...]}.
+def import_flights(rows, chunk_size=None, dry_run=False):
+    chunk_size = chunk_size or app.config["IMPORT_CHUNK_SIZE"]
+    report = {"imported": 0, "failed": 0, "errors": []}
+
+    def error(line_num, message):
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append((line_num, message))
+
+    def save(chunk, line_nums):
+        add_durations(chunk)
+        valid = []
+        for values, line_num in zip(chunk, line_nums):
+            if values['duration'] is None:
+                error(line_num, "arrival must be after departure")
+            else:
+                valid.append(values)
+        if valid and not dry_run:
+            db.session.execute(insert(Flight), valid)
+            db.session.commit()
+            # core inserts don't go through the session's flush events (events.py), so caches are told here
+            flights_changed.send(db.session, keys={(v['cityFrom'],v['cityTo'],v['fclass'],v['departDate']) for v in valid})
+        report["imported"] += len(valid)
+
+    chunk, line_nums = [], []
+    for line_num, row in rows:
+        values, message = validate_row(row)
+        if message:
+            error(line_num, message)
+            continue
+        chunk.append(values)
+        line_nums.append(line_num)
+        if len(chunk) >= chunk_size:
+            save(chunk, line_nums)
+            chunk, line_nums = [], []
+    if chunk:
+        save(chunk, line_nums)
+    # arrival/departure errors are found a chunk later than the others, so put the report back in file order
+    report["errors"].sort()
+    return report
+
+
+# export every flight, in flight number order, as chunks of text.
+# rows are fetched yield_per at a time (a server side cursor where the database has one), so memory use stays
+# the same however big the table is.
+def export_flights(fmt="csv", yield_per=1000):
+    columns = [Flight.__table__.c[field] for field in EXPORT_FIELDS]
+    result = db.session.execute(select(*columns).order_by(Flight.num).execution_options(yield_per=yield_per))
+    if fmt == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for rows in result.partitions():
+            for row in rows:
+                writer.writerow(export_values(row))
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    elif fmt == "jsonl":
+        for rows in result.partitions():
+            yield "".join(json.dumps(dict(zip(EXPORT_FIELDS, export_values(row)))) + "\n" for row in rows)
+    else:
+        raise ImportFormatError(f"Unknown format: {fmt}")
+
+# dates and times in the same format the import reads, duration in minutes
+def export_values(row):
+    values = []
+    for field, value in zip(EXPORT_FIELDS, row):
+        if field == 'duration':
+            value = int(value.total_seconds() // 60)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        values.append(value)
+    return values
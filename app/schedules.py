@@ -0,0 +1,106 @@
+from app import app
+from flask import g, has_app_context
+
+from datetime import date, datetime, timedelta
+from sqlalchemy import and_, delete, exists, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.cache import LRUCache
+from app.events import flights_changed, mark_flights_changed
+from app.models import db, Flight, Schedule, SeatHold
+
+# recurring schedules are turned into dated Flight rows ("materialized") in two ways:
+# - lazily: a search for a route, class and day creates that day's flights first (ensure_materialized)
+# - ahead of time: "flask materialize-schedules" creates every flight in the next SCHEDULE_WINDOW_DAYS days
+# so the flight table only holds flights someone searched for or that are coming up soon.
+
+# (cityFrom, cityTo, fclass, date) keys that were already materialized by this worker, so a search only
+# checks the schedules the first time a day is searched. Cleared when a schedule changes in this worker,
+# other workers catch up after SCHEDULE_CHECK_TTL seconds.
+checked_days = LRUCache(maxsize=100000, ttl=app.config["SCHEDULE_CHECK_TTL"])
+
+
+def runs_on(schedule, day):
+    return schedule.validFrom <= day <= schedule.validTo and str(day.isoweekday()) in schedule.daysOfWeek
+
+def flight_values(schedule, day):
+    arrivalDate = day + timedelta(days=schedule.arrivalDays)
+    return {"cityFrom":schedule.cityFrom,"cityTo":schedule.cityTo,"fclass":schedule.fclass,"price":schedule.price,
+            "capacity":schedule.capacity,"departDate":day,"departTime":schedule.departTime,"arrivalDate":arrivalDate,
+            "arrivalTime":schedule.arrivalTime,"schedule_id":schedule.id,
+            "duration":datetime.combine(arrivalDate,schedule.arrivalTime) - datetime.combine(day,schedule.departTime)}
+
+
+# create the missing flights of the matching schedules between start and end (both included).
+# runs in its own transaction on the primary database, so it works from read-only (replica) pages and doesn't
+# commit anything the caller has in db.session. Returns the number of flights created.
+def materialize(start, end, route=None):
+    start = max(start, date.today())
+    if start > end:
+        return 0
+    # plain rows (not Schedule objects), this runs on its own connection outside db.session
+    query = select(Schedule.__table__).where(Schedule.validFrom <= end, Schedule.validTo >= start)
+    if route:
+        cityFrom, cityTo, fclass = route
+        query = query.where(Schedule.cityFrom == cityFrom, Schedule.cityTo == cityTo, Schedule.fclass == fclass)
+    # two workers can create the same flights at the same time. The unique index on (schedule_id, departDate)
+    # makes the slower one fail, it then tries again and finds the flights already there.
+    for attempt in range(2):
+        try:
+            with db.engine.begin() as connection:
+                schedules = connection.execute(query).all()
+                if not schedules:
+                    return 0
+                existing = set(connection.execute(
+                    select(Flight.schedule_id, Flight.departDate).where(
+                        Flight.schedule_id.in_([s.id for s in schedules]), Flight.departDate.between(start, end))))
+                rows = [flight_values(schedule, start + timedelta(days=i))
+                        for i in range((end - start).days + 1) for schedule in schedules
+                        if runs_on(schedule, start + timedelta(days=i)) and (schedule.id, start + timedelta(days=i)) not in existing]
+                if rows:
+                    connection.execute(insert(Flight), rows)
+            break
+        except IntegrityError:
+            if attempt:
+                raise
+    if rows:
+        # core inserts don't go through the session's flush events (events.py), so caches are told here
+        flights_changed.send(db.session, keys={(r["cityFrom"],r["cityTo"],r["fclass"],r["departDate"]) for r in rows})
+        # the new flights are only on the primary so far, read the rest of this request from there
+        if has_app_context():
+            g.use_replica = False
+    return len(rows)
+
+
+# called by searches before they query flights: makes sure the schedule flights for these days exist.
+# after the first search for a day this is a few cache lookups and no queries.
+def ensure_materialized(cityFrom, cityTo, fclass, start, end):
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    unchecked = [day for day in days if not checked_days.get((cityFrom, cityTo, fclass, day))]
+    if not unchecked:
+        return 0
+    created = materialize(min(unchecked), max(unchecked), route=(cityFrom, cityTo, fclass))
+    for day in unchecked:
+        checked_days.set((cityFrom, cityTo, fclass, day), True)
+    return created
+
+
+# the rolling window for "flask materialize-schedules": every schedule's flights from today to `days` ahead
+def materialize_window(days=None):
+    days = days or app.config["SCHEDULE_WINDOW_DAYS"]
+    return materialize(date.today(), date.today() + timedelta(days=days))
+
+
+# after a schedule is edited or deleted: remove its upcoming flights that nobody has booked or is holding a seat on,
+# with one DELETE. They're created again from the new schedule when they're needed (edited) or not at all (deleted).
+# flights with bookings are kept as they are, and are unlinked from a deleted schedule.
+# part of the caller's transaction.
+def drop_unsold_flights(schedule_id, unlink=False):
+    unsold = and_(Flight.schedule_id == schedule_id, Flight.departDate >= date.today(), Flight.seatsSold == 0,
+                  ~exists().where(SeatHold.flight_num == Flight.num))
+    keys = {tuple(row) for row in db.session.execute(select(Flight.cityFrom, Flight.cityTo, Flight.fclass, Flight.departDate).where(unsold))}
+    db.session.execute(delete(Flight).where(unsold).execution_options(synchronize_session=False))
+    if unlink:
+        db.session.execute(Flight.__table__.update().where(Flight.schedule_id == schedule_id).values(schedule_id=None))
+    mark_flights_changed(db.session, keys)
+    checked_days.clear()
@@ -0,0 +1,174 @@
+from app import app
+
+import json
+from collections import namedtuple
+from datetime import date, time, timedelta
+from sqlalchemy import or_, and_
+
+from app.cache import LRUCache, SQLCache, register_cache
+from app.events import flights_changed
+from app.models import Flight
+from app.schedules import ensure_materialized
+
+# flights are listed in departure order. num is added at the end so that the order is always unique,
+# otherwise two flights departing at the same time could be skipped or shown twice between pages.
+FLIGHT_ORDER = (Flight.departDate, Flight.departTime, Flight.num)
+
+
+# form inputs give dates as "2025-01-31" and times as "10:30" (or "10:30:00"), the Flight columns need date/time objects.
+# empty or broken values return None so optional filters can be skipped.
+def parse_date(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def parse_time(value):
+    try:
+        return time.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# the cursor is the sort key of the last flight on the page, joined with "_" so it can go in a url.
+# example: 2025-01-31_10:30:00_42
+def make_cursor(flight):
+    return f"{flight.departDate.isoformat()}_{flight.departTime.isoformat()}_{flight.num}"
+
+def parse_cursor(cursor):
+    try:
+        departDate, departTime, num = cursor.split("_")
+        return date.fromisoformat(departDate), time.fromisoformat(departTime), int(num)
+    except (AttributeError, ValueError):
+        # broken or missing cursor just starts from the first page
+        return None
+
+
+# query arguments of the flight listing: the filters below and the page cursor
+LISTING_ARGS = ("cityFrom","cityTo","dateFrom","dateTo","fclass","after")
+
+
+# apply the optional filters from the listing form (route, date range and class).
+# only filters that were filled in are applied, so an empty form shows every flight.
+def filter_flights(query, filters):
+    if filters.get("cityFrom"):
+        query = query.filter(Flight.cityFrom == filters["cityFrom"])
+    if filters.get("cityTo"):
+        query = query.filter(Flight.cityTo == filters["cityTo"])
+    if parse_date(filters.get("dateFrom")):
+        query = query.filter(Flight.departDate >= parse_date(filters["dateFrom"]))
+    if parse_date(filters.get("dateTo")):
+        query = query.filter(Flight.departDate <= parse_date(filters["dateTo"]))
+    if filters.get("fclass"):
+        query = query.filter(Flight.fclass == filters["fclass"])
+    return query
+
+
+# keyset (cursor) pagination: instead of OFFSET (which makes the database walk over every skipped row),
+# we ask for rows that come after the last row of the previous page. With the indexes on Flight this is
+# an index range scan, so page 1000 is as fast as page 1.
+# returns the flights on this page and the cursor for the next page (None on the last page).
+def flight_page(filters, per_page=None):
+    per_page = per_page or app.config["FLIGHTS_PER_PAGE"]
+    query = filter_flights(Flight.query, filters)
+
+    after = parse_cursor(filters.get("after"))
+    if after:
+        departDate, departTime, num = after
+        # (departDate, departTime, num) > (after values), written out so it works on every database
+        query = query.filter(or_(
+            Flight.departDate > departDate,
+            and_(Flight.departDate == departDate, Flight.departTime > departTime),
+            and_(Flight.departDate == departDate, Flight.departTime == departTime, Flight.num > num),
+        ))
+
+    # fetch one extra row to know if there is a next page without running a COUNT(*)
+    flights = query.order_by(*FLIGHT_ORDER).limit(per_page + 1).all()
+    next_cursor = None
+    if len(flights) > per_page:
+        flights = flights[:per_page]
+        next_cursor = make_cursor(flights[-1])
+    return flights, next_cursor
+
+
+# columns shown on the departure page. Search results are rows of these (not Flight objects), so they can be cached.
+SEARCH_COLUMNS = (Flight.num, Flight.cityFrom, Flight.cityTo, Flight.departDate, Flight.departTime, Flight.arrivalDate,
+                  Flight.arrivalTime, Flight.duration, Flight.fclass, Flight.price, Flight.capacity, Flight.seatsSold)
+FlightResult = namedtuple("FlightResult", [column.key for column in SEARCH_COLUMNS])
+
+
+# the shared (sql) cache stores json, so dates, times and durations are saved as strings/seconds
+# (also used for the flights of archived bookings, see archive.py)
+def encode_flight(flight):
+    return [value.isoformat() if hasattr(value, "isoformat") else value.total_seconds() if isinstance(value, timedelta) else value
+            for value in flight]
+
+def decode_flight(row):
+    values = dict(zip(FlightResult._fields, row))
+    for field in ("departDate", "arrivalDate"):
+        values[field] = date.fromisoformat(values[field])
+    for field in ("departTime", "arrivalTime"):
+        values[field] = time.fromisoformat(values[field])
+    values["duration"] = timedelta(seconds=values["duration"])
+    return FlightResult(**values)
+
+def encode_results(flights):
+    return json.dumps([encode_flight(flight) for flight in flights])
+
+def decode_results(data):
+    return [decode_flight(row) for row in json.loads(data)]
+
+
+# search results per route, class and day: key "cityFrom|cityTo|departDate|fclass", value the list of FlightResults.
+# "memory" keeps them in each worker, "sql" shares them between workers (see cache.py).
+SEARCH_CACHES = {
+    "memory": lambda: LRUCache(maxsize=app.config["SEARCH_CACHE_SIZE"], ttl=app.config["SEARCH_CACHE_TTL"]),
+    "sql": lambda: SQLCache("search", ttl=app.config["SEARCH_CACHE_TTL"], dumps=encode_results, loads=decode_results),
+}
+search_cache = register_cache("search", SEARCH_CACHES[app.config["SEARCH_CACHE"]]())
+
+def search_key(cityFrom, cityTo, departDate, fclass):
+    return f"{cityFrom}|{cityTo}|{departDate.isoformat()}|{fclass}"
+
+
+# booking search: flights on a route and class departing on departDate, or within +-days of it.
+# each day's flights come from search_cache, days that aren't cached are read with one query (it matches
+# ix_flight_search (cityFrom, cityTo, departDate, fclass), so it's an index lookup) and then cached.
+# departDate can be a date or a "2025-01-31" string from the session.
+# only flights with at least `passengers` places left are returned (uses the seatsSold counter, no counting bookings).
+def find_flights(cityFrom, cityTo, departDate, fclass, days=0, passengers=1):
+    departDate = parse_date(departDate) if isinstance(departDate, str) else departDate
+    if departDate is None:
+        return []
+    start, end = departDate - timedelta(days=days), departDate + timedelta(days=days)
+    # flights from recurring schedules are created the first time their day is searched
+    ensure_materialized(cityFrom, cityTo, fclass, start, end)
+
+    by_day, missing = {}, []
+    for i in range((end - start).days + 1):
+        day = start + timedelta(days=i)
+        cached = search_cache.get(search_key(cityFrom, cityTo, day, fclass))
+        if cached is None:
+            missing.append(day)
+        else:
+            by_day[day] = cached
+    if missing:
+        # every flight on those days, full ones too, so one cache entry works for any number of passengers
+        rows = Flight.query.with_entities(*SEARCH_COLUMNS).filter(
+            Flight.cityFrom == cityFrom, Flight.cityTo == cityTo, Flight.fclass == fclass,
+            Flight.departDate.between(min(missing), max(missing))).order_by(*FLIGHT_ORDER)
+        found = {day: [] for day in missing}
+        for row in rows:
+            if row.departDate in found:
+                found[row.departDate].append(FlightResult(*row))
+        for day, flights in found.items():
+            search_cache.set(search_key(cityFrom, cityTo, day, fclass), flights)
+        by_day.update(found)
+    return [f for day in sorted(by_day) for f in by_day[day] if f.capacity - f.seatsSold >= passengers]
+
+
+# a flight on a cached day was added, edited, deleted, or had places sold or given back: drop that day's results
+@flights_changed.connect
+def invalidate_search_cache(sender, keys):
+    for cityFrom, cityTo, fclass, departDate in keys:
+        search_cache.delete(search_key(cityFrom, cityTo, departDate, fclass))
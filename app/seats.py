@@ -0,0 +1,160 @@
+from app import app
+
+from datetime import datetime, timedelta
+from sqlalchemy import delete, exists, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Flight, SeatHold
+from app.events import mark_flights_changed
+
+# we currently only have 1 type of plane, so 1 seat layout (rows 1-5, seats A-D).
+# every seat gets a bit in Flight.seatMap, in this order: 1A=bit 0, 1B=bit 1, ... 5D=bit 19.
+SEAT_ROWS = [1,2,3,4,5]
+SEAT_LETTERS = ['A','B','C','D']
+SEATS = [f"{row}{letter}" for row in SEAT_ROWS for letter in SEAT_LETTERS]
+
+
+class SeatUnavailable(Exception):
+    def __init__(self, flight_num, seat):
+        super().__init__(f"Seat {seat} is not available on flight {flight_num}.")
+        self.flight_num = flight_num
+        self.seat = seat
+
+
+class FlightFull(Exception):
+    def __init__(self, flight_num, count):
+        super().__init__(f"Flight {flight_num} doesn't have {count} places left.")
+        self.flight_num = flight_num
+        self.count = count
+
+
+# bit for a seat in Flight.seatMap, None if the seat isn't in the layout
+def seat_bit(seat):
+    if seat not in SEATS:
+        return None
+    return 1 << SEATS.index(seat)
+
+def seats_in(seat_map):
+    return [seat for i, seat in enumerate(SEATS) if seat_map & (1 << i)]
+
+
+# seats that can't be chosen on these flights: sold seats plus seats other customers are holding.
+# draft_id is the current customer's draft, their own holds are not counted as taken.
+# two queries, whatever the number of flights or seats.
+def taken_seats(flight_nums, draft_id=None):
+    taken = set()
+    for (seat_map,) in db.session.query(Flight.seatMap).filter(Flight.num.in_(flight_nums)):
+        taken.update(seats_in(seat_map))
+    holds = db.session.query(SeatHold.seat).filter(SeatHold.flight_num.in_(flight_nums), SeatHold.expires > datetime.now())
+    if draft_id:
+        holds = holds.filter(SeatHold.draft_id != draft_id)
+    taken.update(seat for (seat,) in holds)
+    return [seat for seat in SEATS if seat in taken]
+
+
+# hold a seat for a draft while they finish the wizard. Returns False if the seat is sold or held by someone else.
+# runs in its own transaction. The unique constraint on (flight_num, seat) decides who wins when several
+# workers try to hold the same seat at the same time: only one insert can succeed.
+# the hold is only inserted if the seat's bit is still 0 (INSERT ... SELECT from the flight), so checking and holding
+# is one statement and a seat sold a moment ago can't be held.
+def hold_seat(flight_num, seat, draft_id):
+    bit = seat_bit(seat)
+    if bit is None:
+        return False
+    table = SeatHold.__table__
+    now = datetime.now()
+    hold = select(literal(flight_num), literal(seat), literal(draft_id),
+                  literal(now + timedelta(minutes=app.config["SEAT_HOLD_MINUTES"])))
+    try:
+        with db.engine.begin() as connection:
+            # a customer only holds one seat per flight, so drop their old hold when they change seats,
+            # and clear out an expired hold on the seat they want
+            connection.execute(delete(table).where(table.c.flight_num == flight_num, table.c.draft_id == draft_id))
+            connection.execute(delete(table).where(table.c.flight_num == flight_num, table.c.seat == seat, table.c.expires <= now))
+            held = connection.execute(insert(table).from_select(["flight_num","seat","draft_id","expires"], hold.where(
+                Flight.num == flight_num, Flight.seatMap.op('&')(bit) == 0))).rowcount == 1
+            if not held:
+                # sold (or no such flight): the customer keeps the seat they were holding
+                connection.rollback()
+        return held
+    except IntegrityError:
+        # someone else holds it
+        return False
+
+
+# remove expired holds ("flask sweep"), they're already ignored everywhere. Returns how many were deleted.
+def delete_expired_holds():
+    with db.engine.begin() as connection:
+        return connection.execute(delete(SeatHold.__table__).where(SeatHold.__table__.c.expires <= datetime.now())).rowcount
+
+
+# sell a seat as part of the booking transaction (db.session, not committed here).
+# the UPDATE only changes the row if the seat's bit is still 0 and nobody else has a live hold on it, so checking
+# and selling is one atomic statement. If it matches no row the seat is gone and SeatUnavailable is raised,
+# the caller then rolls back the whole booking.
+def sell_seat(flight_num, seat, draft_id=None):
+    bit = seat_bit(seat)
+    if bit is None:
+        raise SeatUnavailable(flight_num, seat)
+    live_hold = [SeatHold.flight_num == flight_num, SeatHold.seat == seat, SeatHold.expires > datetime.now()]
+    if draft_id:
+        live_hold.append(SeatHold.draft_id != draft_id)
+    held_by_other = exists().where(*live_hold)
+    result = db.session.execute(
+        update(Flight)
+        .where(Flight.num == flight_num, Flight.seatMap.op('&')(bit) == 0, ~held_by_other)
+        .values(seatMap=Flight.seatMap.op('|')(bit))
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        raise SeatUnavailable(flight_num, seat)
+    if draft_id:
+        db.session.execute(delete(SeatHold).where(SeatHold.flight_num == flight_num, SeatHold.draft_id == draft_id))
+
+
+# give a seat back (booking cancelled). Part of the caller's transaction.
+def release_seat(flight_num, seat):
+    bit = seat_bit(seat)
+    if bit is None:
+        return
+    db.session.execute(
+        update(Flight).where(Flight.num == flight_num)
+        .values(seatMap=Flight.seatMap.op('&')(~bit))
+        .execution_options(synchronize_session=False)
+    )
+
+
+# the flight's search key is returned by the UPDATE itself, so cached searches showing the places left
+# can be dropped after the commit (see events.py) without another query. With the price, it's also what the
+# reports need (reports.py), so sell_places/release_places return it.
+FLIGHT_KEY = (Flight.cityFrom, Flight.cityTo, Flight.fclass, Flight.departDate)
+
+# sell count places (one per passenger) as part of the booking transaction.
+# like sell_seat, the capacity check and the update are one statement, so two bookings racing for the last
+# places can't both get them. Raises FlightFull if there isn't enough room.
+# returns the flight's (cityFrom, cityTo, fclass, departDate, price).
+def sell_places(flight_num, count):
+    flight = db.session.execute(
+        update(Flight)
+        .where(Flight.num == flight_num, Flight.seatsSold + count <= Flight.capacity)
+        .values(seatsSold=Flight.seatsSold + count)
+        .returning(*FLIGHT_KEY, Flight.price)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if flight is None:
+        raise FlightFull(flight_num, count)
+    mark_flights_changed(db.session, [tuple(flight)[:4]])
+    return flight
+
+# give places back (booking cancelled). Part of the caller's transaction.
+# returns the same row as sell_places, or None if the flight doesn't exist anymore.
+def release_places(flight_num, count):
+    flight = db.session.execute(
+        update(Flight).where(Flight.num == flight_num)
+        .values(seatsSold=Flight.seatsSold - count)
+        .returning(*FLIGHT_KEY, Flight.price)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if flight:
+        mark_flights_changed(db.session, [tuple(flight)[:4]])
+    return flight
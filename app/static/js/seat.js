@@ -12,4 +12,17 @@ for (var i = 0; i < allButtons.length; i++) {
     // add a url query parameter for flask
     window.location.href = "/seat?chosenSeat="+buttonText;
   })
-}
\ No newline at end of file
+}
+
+// disable seats that are already sold or held by someone else (one request for all flights in the booking)
+const seatSelector = document.getElementById("seatSelector")
+fetch("/seat-availability?flights=" + seatSelector.dataset.flights)
+  .then(function(response) { return response.json() })
+  .then(function(data) {
+    for (var i = 0; i < allButtons.length; i++) {
+      if (data.taken.includes(allButtons[i].innerText.trim())) {
+        allButtons[i].disabled = true;
+        allButtons[i].classList.replace("btn-outline-danger", "btn-secondary");
+      }
+    }
+  })
@@ -0,0 +1,83 @@
+# measures how many bookings per second can be saved.
+# payment mode: the wizard steps before payment are run untimed for every booking, only POST /payment is timed.
+# bulk mode: bookings are sent to the agency bulk api in batches of --batch-size.
+#
+# usage: python benchmarks/booking_throughput.py --bookings 200 --passengers 9
+#        python benchmarks/booking_throughput.py --mode bulk --bookings 2000 --batch-size 100
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--bookings",type=int,default=200)
+parser.add_argument("--passengers",type=int,default=9)
+parser.add_argument("--mode",choices=["payment","bulk"],default="payment")
+parser.add_argument("--batch-size",type=int,default=100)
+parser.add_argument("--database-url",help="defaults to a new sqlite file in a temp folder")
+args = parser.parse_args()
+
+# the app reads DATABASE_URL when it's imported, so this has to be set first
+os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(),"bench.db")
+os.environ["AGENCY_API_KEYS"] = "bench"
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import date, time as dtime
+from app import app, db
+from app.models import Flight
+from app.admin_routes import calculateDuration
+from app.seats import SEATS
+
+# every seat can only be sold once, so create enough flights for one booking per seat,
+# with room for every passenger of those bookings (the default capacity would only fit a few)
+with app.app_context():
+    db.create_all()
+    day = date(2030,1,1)
+    flights = [Flight(cityFrom="Sydney",cityTo="Dhaka",departDate=day,arrivalDate=day,departTime=dtime(10,0),arrivalTime=dtime(14,0),
+                      duration=calculateDuration(day,dtime(10,0),day,dtime(14,0)),fclass="Economy",price=100,
+                      capacity=len(SEATS) * args.passengers)
+               for _ in range(args.bookings // len(SEATS) + 1)]
+    db.session.add_all(flights)
+    db.session.commit()
+    flight_nums = [flight.num for flight in flights]
+
+# flight and seat for the i-th booking
+def flight_and_seat(i):
+    return flight_nums[i // len(SEATS)], SEATS[i % len(SEATS)]
+
+client = app.test_client()
+details = {"email":"bench@example.com","phone":"0400000000"}
+for p in range(args.passengers):
+    details.update({f"title{p}":"Mr.",f"fname{p}":f"Pass{p}",f"lname{p}":"Bench",f"nationality{p}":"AU",f"gender{p}":"male"})
+
+def run_payment():
+    timed = 0.0
+    for i in range(args.bookings):
+        client.post("/",data={"cityFrom":"Sydney","cityTo":"Dhaka","departDate":"2030-01-01","returnDate":"","fclass":"Economy","passenger_num":str(args.passengers)})
+        flight_num, seat = flight_and_seat(i)
+        client.get(f"/save_flight/{flight_num}")
+        client.post("/personal-details",data=details)
+        client.get(f"/save-seat/{seat}")
+        client.get("/meal/halal")
+        start = time.perf_counter()
+        response = client.post("/payment")
+        timed += time.perf_counter() - start
+        # a failed booking redirects too (back to the start), only a redirect to the confirmed page is a booking
+        assert response.status_code == 302 and response.location.startswith("/confirmed/"), (response.status_code, response.location)
+    return timed
+
+def run_bulk():
+    passengers = [{"title":"Mr.","fname":f"Pass{p}","lname":"Bench","nationality":"AU","gender":"male"} for p in range(args.passengers)]
+    def booking(i):
+        flight_num, seat = flight_and_seat(i)
+        return {"depart_flight_num":flight_num,"meal":"Halal","seat":seat,"email":"bench@example.com","phone":"0400000000","passengers":passengers}
+    start = time.perf_counter()
+    for i in range(0, args.bookings, args.batch_size):
+        batch = [booking(j) for j in range(i, min(i + args.batch_size, args.bookings))]
+        response = client.post("/api/v1/bookings/bulk",json={"bookings":batch},headers={"X-API-Key":"bench"})
+        assert response.status_code == 201, response.json
+    return time.perf_counter() - start
+
+timed = run_payment() if args.mode == "payment" else run_bulk()
+print(f"{args.mode}: {args.bookings} bookings x {args.passengers} passengers: {timed:.2f}s, {args.bookings / timed:.1f} bookings/sec")
@@ -0,0 +1,319 @@
+# load test for the whole booking funnel, run against the real app.
+# it seeds a synthetic schedule (--flights rows over --days days, busy hub routes get more flights than small ones)
+# and a booking history (--history bookings that already sold some seats), then books --runs times going through
+# every page a customer opens:
+#   index (POST) -> departure -> save_flight -> personal_details (GET, POST) -> seat -> seat_availability
+#   -> save_seat -> save_meal -> payment (GET, POST) -> confirmed
+# for every step it reports p50/p95/p99 latency, requests/sec and SQL queries per request.
+# --output writes the results as json, so two releases can be compared with a diff.
+#
+# requests go through the flask test client by default, or with --server through a local wsgi server over http.
+# --database-url is for a local postgres: use an empty database, its tables are dropped and recreated.
+#
+# usage: python benchmarks/funnel.py --flights 10000 --runs 200
+#        python benchmarks/funnel.py --flights 1000000 --history 50000 --output funnel.json
+#        python benchmarks/funnel.py --database-url postgresql://localhost/flights_bench --server
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--flights",type=int,default=10000)
+parser.add_argument("--days",type=int,default=180,help="the schedule is spread over this many days")
+parser.add_argument("--history",type=int,default=2000,help="bookings already made before the benchmark starts")
+parser.add_argument("--runs",type=int,default=200,help="bookings made through the funnel (the timed part)")
+parser.add_argument("--warmup",type=int,default=10,help="untimed bookings made first")
+parser.add_argument("--passengers",type=int,default=2)
+parser.add_argument("--seed",type=int,default=1)
+parser.add_argument("--server",action="store_true",help="send requests over http to a local wsgi server")
+parser.add_argument("--database-url",help="defaults to a new sqlite file in a temp folder")
+parser.add_argument("--output",help="write the results to this json file")
+args = parser.parse_args()
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the app reads DATABASE_URL when it's imported, so this has to be set first
+os.environ["DATABASE_URL"] = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(),"funnel.db")
+sys.path.insert(0,ROOT)
+
+from datetime import date, time as dtime, timedelta
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlparse
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, build_opener
+from werkzeug.serving import WSGIRequestHandler, make_server
+import sqlalchemy
+from sqlalchemy import event, insert
+from sqlalchemy.engine import Engine
+from app import app, db
+from app.models import Booking, Flight, Passenger, booking_passenger, create_missing_indexes
+from app.admin_routes import calculateDuration
+from app.bookings import generate_ref
+from app.seats import SEATS, seat_bit
+
+# cities with a weight, hubs get picked far more often, so a few routes have many flights and most have a few
+CITIES = {"Sydney":30,"Dubai":30,"Singapore":25,"London":25,"Dhaka":15,"Melbourne":15,"Tokyo":15,"Delhi":12,
+          "Bangkok":10,"Paris":10,"New York":10,"Auckland":6,"Perth":6,"Brisbane":6,"Colombo":4,"Karachi":4,
+          "Kathmandu":3,"Denpasar":3,"Manila":3,"Nairobi":2,"Lima":1,"Fiji":1}
+CLASSES = {"Economy":70,"Business":20,"First":10}
+PRICES = {"Economy":(150,900),"Business":(900,3000),"First":(3000,9000)}
+FIRST_DAY = date(2030,1,1)
+CHUNK = 10000
+
+rng = random.Random(args.seed)
+
+
+# ---- seeding ----
+
+def flight_rows():
+    cities, weights = list(CITIES), list(CITIES.values())
+    # a fixed set of routes, each with its own popularity
+    routes = {}
+    while len(routes) < min(150, len(cities) * (len(cities) - 1)):
+        cityFrom, cityTo = rng.choices(cities,weights,k=2)
+        if cityFrom != cityTo:
+            routes[(cityFrom,cityTo)] = CITIES[cityFrom] * CITIES[cityTo]
+    route_list, route_weights = list(routes), list(routes.values())
+    for _ in range(args.flights):
+        cityFrom, cityTo = rng.choices(route_list,route_weights)[0]
+        fclass = rng.choices(list(CLASSES),list(CLASSES.values()))[0]
+        departDate = FIRST_DAY + timedelta(days=rng.randrange(args.days))
+        departTime = dtime(rng.randrange(6,23),rng.randrange(0,60,5))
+        minutes = departTime.hour * 60 + departTime.minute + rng.randrange(60,15 * 60,5)
+        arrivalDate, arrivalTime = departDate + timedelta(days=minutes // (24 * 60)), dtime(minutes // 60 % 24, minutes % 60)
+        yield {"cityFrom":cityFrom,"cityTo":cityTo,"departDate":departDate,"arrivalDate":arrivalDate,"departTime":departTime,
+               "arrivalTime":arrivalTime,"duration":calculateDuration(departDate,departTime,arrivalDate,arrivalTime),
+               "fclass":fclass,"price":rng.randrange(*PRICES[fclass]),"capacity":len(SEATS),"seatsSold":0,"seatMap":0}
+
+
+# flights are inserted in chunks with core inserts (not one ORM object per row), so 1M rows take minutes, not hours.
+# returns every flight as a dict with its num, the history bookings then fill in seatsSold and seatMap.
+def seed_flights():
+    flights, chunk = [], []
+    statement = insert(Flight).returning(Flight.num,sort_by_parameter_order=True)
+    def flush():
+        for row, num in zip(chunk, db.session.execute(statement,chunk).scalars()):
+            row["num"] = num
+            flights.append(row)
+        chunk.clear()
+    for row in flight_rows():
+        chunk.append(row)
+        if len(chunk) == CHUNK:
+            flush()
+    if chunk:
+        flush()
+    return flights
+
+
+# bookings made before the benchmark: each takes a seat and some places on a random flight
+def seed_history(flights):
+    bookings = []
+    for _ in range(args.history):
+        flight = rng.choice(flights)
+        passenger_num = rng.randint(1,4)
+        free = [seat for seat in SEATS if not flight["seatMap"] & seat_bit(seat)]
+        if not free or flight["seatsSold"] + passenger_num > flight["capacity"]:
+            continue
+        seat = rng.choice(free)
+        flight["seatMap"] |= seat_bit(seat)
+        flight["seatsSold"] += passenger_num
+        bookings.append(({"depart_flight_num":flight["num"],"return_flight_num":None,"meal":"Halal","seat":seat,
+                          "email":"seed@example.com","phone":"0400000000","ref":generate_ref()}, passenger_num))
+    for i in range(0, len(bookings), CHUNK):
+        chunk = bookings[i:i + CHUNK]
+        booking_ids = db.session.execute(insert(Booking).returning(Booking.id,sort_by_parameter_order=True),
+                                         [row for row, _ in chunk]).scalars().all()
+        passenger_rows, owners = [], []
+        for booking_id, (_, passenger_num) in zip(booking_ids, chunk):
+            for p in range(passenger_num):
+                passenger_rows.append({"title":"Ms.","fname":f"Seed{p}","lname":"History","nationality":"AU","gender":"female"})
+                owners.append(booking_id)
+        passenger_ids = db.session.execute(insert(Passenger).returning(Passenger.id,sort_by_parameter_order=True),passenger_rows).scalars().all()
+        db.session.execute(insert(booking_passenger),[{"booking_id":b,"passenger_id":p} for b, p in zip(owners, passenger_ids)])
+    sold = [{"num":f["num"],"seatsSold":f["seatsSold"],"seatMap":f["seatMap"]} for f in flights if f["seatsSold"]]
+    for i in range(0, len(sold), CHUNK):
+        db.session.execute(sqlalchemy.update(Flight),sold[i:i + CHUNK])
+    return len(bookings)
+
+
+def seed():
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        create_missing_indexes()
+        start = time.perf_counter()
+        flights = seed_flights()
+        history = seed_history(flights)
+        db.session.commit()
+        print(f"seeded {len(flights)} flights and {history} bookings in {time.perf_counter() - start:.1f}s")
+    return flights
+
+
+# ---- clients ----
+
+# both clients return (status code, body, redirect path)
+class TestClient:
+    def __init__(self):
+        self.client = app.test_client()
+
+    def open(self, method, path, data=None):
+        response = self.client.open(path,method=method,data=data)
+        return response.status_code, response.get_data(as_text=True), urlparse(response.location or "").path
+
+class NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class ServerClient:
+    base_url = None
+
+    def __init__(self):
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),NoRedirect)
+
+    def open(self, method, path, data=None):
+        # urllib sends a POST when there is a body (even an empty one)
+        body = urlencode(data or {}).encode() if method == "POST" else None
+        try:
+            response = self.opener.open(self.base_url + path,data=body)
+        except HTTPError as error:
+            # redirects end up here because NoRedirect doesn't follow them
+            response = error
+        return response.status, response.read().decode(), urlparse(response.headers.get("Location") or "").path
+
+# werkzeug logs every request by default, which would flood the output and slow the server down
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+def start_server():
+    server = make_server("127.0.0.1",0,app,request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever,daemon=True).start()
+    ServerClient.base_url = f"http://127.0.0.1:{server.server_port}"
+
+
+# ---- funnel ----
+
+# every query on every engine, for the queries per request numbers
+queries = [0]
+event.listen(Engine,"before_cursor_execute",lambda *args: queries.__setitem__(0, queries[0] + 1))
+
+class Steps:
+    def __init__(self):
+        self.latency = {}
+        self.queries = {}
+
+    def request(self, client, name, method, path, data=None, expect=(200,)):
+        queries[0] = 0
+        start = time.perf_counter()
+        status, body, location = client.open(method,path,data)
+        seconds = time.perf_counter() - start
+        assert status in expect, (name, path, status)
+        self.latency.setdefault(name,[]).append(seconds)
+        self.queries.setdefault(name,[]).append(queries[0])
+        return body, location
+
+
+# true if the flight still has a seat and enough places for another funnel booking
+def bookable(flight):
+    return flight["seatsSold"] + args.passengers <= flight["capacity"] and flight["seatMap"] != (1 << len(SEATS)) - 1
+
+def book(steps, client, flight):
+    steps.request(client,"index","POST","/",{"cityFrom":flight["cityFrom"],"cityTo":flight["cityTo"],"departDate":flight["departDate"].isoformat(),
+                                            "returnDate":"","fclass":flight["fclass"],"passenger_num":str(args.passengers)},expect=(302,))
+    body, _ = steps.request(client,"departure","GET","/departure")
+    assert f"/save_flight/{flight['num']}" in body, "searched flight is not on the departure page"
+    steps.request(client,"save_flight","GET",f"/save_flight/{flight['num']}",expect=(302,))
+    steps.request(client,"personal_details (GET)","GET","/personal-details")
+    details = {"email":"bench@example.com","phone":"0400000000"}
+    for p in range(args.passengers):
+        details.update({f"title{p}":"Mr.",f"fname{p}":f"Pass{p}",f"lname{p}":"Bench",f"nationality{p}":"AU",f"gender{p}":"male"})
+    steps.request(client,"personal_details (POST)","POST","/personal-details",details,expect=(302,))
+    steps.request(client,"seat","GET","/seat?chosenSeat=NA")
+    taken = json.loads(steps.request(client,"seat_availability","GET",f"/seat-availability?flights={flight['num']}")[0])["taken"]
+    seat = next(seat for seat in SEATS if seat not in taken)
+    steps.request(client,"save_seat","GET",f"/save-seat/{seat}",expect=(302,))
+    steps.request(client,"save_meal","GET","/meal/halal",expect=(302,))
+    steps.request(client,"payment (GET)","GET","/payment")
+    _, location = steps.request(client,"payment (POST)","POST","/payment",expect=(302,))
+    assert location.startswith("/confirmed/"), location
+    steps.request(client,"confirmed","GET",location)
+    flight["seatsSold"] += args.passengers
+    flight["seatMap"] |= seat_bit(seat)
+
+
+def run(flights, count):
+    steps = Steps()
+    make_client = ServerClient if args.server else TestClient
+    start = time.perf_counter()
+    for _ in range(count):
+        flight = rng.choice(flights)
+        while not bookable(flight):
+            flight = rng.choice(flights)
+        book(steps,make_client(),flight)
+    return steps, time.perf_counter() - start
+
+
+# ---- report ----
+
+# nearest-rank percentile
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+def summary(latency, query_counts):
+    total = sum(latency)
+    return {
+        "requests": len(latency),
+        "p50_ms": round(percentile(latency,50) * 1000,3),
+        "p95_ms": round(percentile(latency,95) * 1000,3),
+        "p99_ms": round(percentile(latency,99) * 1000,3),
+        "mean_ms": round(total / len(latency) * 1000,3),
+        "requests_per_sec": round(len(latency) / total,1),
+        "queries_per_request": round(sum(query_counts) / len(query_counts),2),
+        "max_queries": max(query_counts),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git","rev-parse","--short","HEAD"],cwd=ROOT,capture_output=True,text=True,check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    flights = seed()
+    with app.app_context():
+        database = db.engine.dialect.name
+    if args.server:
+        start_server()
+    run(flights,args.warmup)
+    steps, seconds = run(flights,args.runs)
+
+    all_latency = [s for values in steps.latency.values() for s in values]
+    all_queries = [q for values in steps.queries.values() for q in values]
+    results = {
+        "settings": {"flights":args.flights,"days":args.days,"history":args.history,"runs":args.runs,"passengers":args.passengers,
+                     "seed":args.seed,"client":"server" if args.server else "test client","database":database},
+        "environment": {"commit":git_commit(),"python":platform.python_version(),"sqlalchemy":sqlalchemy.__version__},
+        "steps": {name: summary(steps.latency[name],steps.queries[name]) for name in steps.latency},
+        "total": dict(summary(all_latency,all_queries),bookings_per_sec=round(args.runs / seconds,1)),
+    }
+    print(f"{'step':24} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8}")
+    for name, s in list(results["steps"].items()) + [("total", results["total"])]:
+        print(f"{name:24} {s['p50_ms']:8.2f} {s['p95_ms']:8.2f} {s['p99_ms']:8.2f} {s['requests_per_sec']:8.1f} {s['queries_per_request']:8.2f}")
+    print(f"{args.runs} bookings in {seconds:.2f}s, {results['total']['bookings_per_sec']} bookings/sec")
+    if args.output:
+        with open(args.output,"w") as f:
+            json.dump(results,f,indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
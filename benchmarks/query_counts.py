@@ -0,0 +1,85 @@
+# checks that the booking pages run a fixed, small number of SQL queries.
+# every page is requested for a booking with 1 passenger and with 5 passengers: the query count has to be the
+# same for both (no query per passenger or per flight) and within the budget below.
+# exits with code 1 if any page goes over.
+#
+# usage: python benchmarks/query_counts.py
+import os
+import sys
+import tempfile
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(),"queries.db")
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import date, time
+from sqlalchemy import event
+from app import app, db
+from app.models import Booking, Flight
+from app.admin_routes import calculateDuration
+
+# most queries each page is allowed to run.
+# manage (POST) and cancel include the INSERT of their notification into the outbox (see notifications.py).
+# cancel also updates the two report tables for each of its (depart and return) flights (see reports.py).
+BUDGET = {
+    "confirmed": 2,
+    "manage (GET)": 2,
+    "manage (POST)": 5,
+    "cancel": 14,
+}
+
+queries = []
+
+with app.app_context():
+    db.create_all()
+    event.listen(db.engine,"before_cursor_execute",lambda conn, cursor, statement, *args: queries.append(statement))
+    for cityFrom, cityTo, day in (("Sydney","Dhaka",date(2030,1,1)),("Dhaka","Sydney",date(2030,1,8))):
+        db.session.add(Flight(cityFrom=cityFrom,cityTo=cityTo,departDate=day,arrivalDate=day,departTime=time(10,0),arrivalTime=time(14,0),
+                              duration=calculateDuration(day,time(10,0),day,time(14,0)),fclass="Economy",price=100,capacity=100))
+    db.session.commit()
+
+
+def make_booking(client, passenger_num, seat):
+    client.post("/",data={"cityFrom":"Sydney","cityTo":"Dhaka","departDate":"2030-01-01","returnDate":"2030-01-08","fclass":"Economy","passenger_num":str(passenger_num)})
+    client.get("/save_flight/1")
+    client.get("/save_flight/2")
+    details = {"email":"q@example.com","phone":"0400000000"}
+    for p in range(passenger_num):
+        details.update({f"title{p}":"Mr.",f"fname{p}":f"Pass{p}",f"lname{p}":"Query",f"nationality{p}":"AU",f"gender{p}":"male"})
+    client.post("/personal-details",data=details)
+    client.get(f"/save-seat/{seat}")
+    client.get("/meal/halal")
+    booking_id, booking_ref = client.post("/payment").location.split("/")[2:4]
+    return booking_id, booking_ref
+
+
+def count(client, method, url, **kwargs):
+    queries.clear()
+    response = client.open(url,method=method,**kwargs)
+    assert response.status_code in (200, 302), (url, response.status_code)
+    return len(queries)
+
+
+def page_counts(passenger_num, seat):
+    client = app.test_client()
+    booking_id, booking_ref = make_booking(client, passenger_num, seat)
+    with app.app_context():
+        passenger_ids = [p.id for p in db.session.get(Booking,int(booking_id)).passengers]
+    form = {"meal":"Veg","email":"new@example.com","phone":"0400000001"}
+    for pid in passenger_ids:
+        form.update({f"fname{pid}":"New",f"lname{pid}":"Name"})
+    return {
+        "confirmed": count(client,"GET",f"/confirmed/{booking_id}/{booking_ref}"),
+        "manage (GET)": count(client,"GET",f"/manage/{booking_id}/{booking_ref}"),
+        "manage (POST)": count(client,"POST",f"/manage/{booking_id}/{booking_ref}",data=form),
+        "cancel": count(client,"GET",f"/cancel/{booking_id}/{booking_ref}"),
+    }
+
+
+small = page_counts(1,"1A")
+large = page_counts(5,"2A")
+failed = False
+for page, budget in BUDGET.items():
+    ok = small[page] == large[page] and large[page] <= budget
+    failed = failed or not ok
+    print(f"{page:15} 1 passenger: {small[page]:2} queries, 5 passengers: {large[page]:2} queries, budget {budget:2} -> {'OK' if ok else 'FAILED'}")
+sys.exit(1 if failed else 0)
@@ -0,0 +1,118 @@
+# stress test for seat inventory: many worker processes race for the same seat on the same flight.
+# it fails (exit code 1) unless exactly one worker gets the seat in every round.
+#
+# round "hold": every worker tries to hold the seat (like save_seat), then the ones that got a hold try to pay.
+# round "sell": every worker skips the hold and pays straight away (like the bulk api), so only the
+#               atomic seat UPDATE stands between them.
+# round "mixed": half the workers pay straight away, the other half only try to hold the seat. Either one of them
+#                bought it and nobody holds it, or one holds it and nobody bought it.
+#
+# usage: python benchmarks/seat_contention.py --workers 16 --rounds 5
+#        python benchmarks/seat_contention.py --database-url postgresql://localhost/flights_bench
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# mode: "hold" (hold, then pay), "sell" (pay straight away) or "hold only"
+def worker(database_url, flight_num, seat, mode, barrier, results):
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT)
+    from sqlalchemy.exc import OperationalError
+    from app import app, db
+    from app.bookings import create_booking
+    from app.seats import SeatUnavailable, hold_seat
+
+    draft_id = f"worker-{os.getpid()}"
+    passengers = [{"title":"Mr.","fname":"Race","lname":"Test","nationality":"AU","gender":"male"}]
+    with app.app_context():
+        # make every process connect before the race starts
+        db.session.execute(db.select(1))
+        db.session.rollback()
+        barrier.wait()
+        use_hold = mode != "sell"
+        if use_hold and not hold_seat(flight_num, seat, draft_id):
+            results.put("no hold")
+            return
+        if mode == "hold only":
+            results.put("held")
+            return
+        try:
+            create_booking(flight_num, None, "Halal", seat, "race@example.com", "0400000000", passengers,
+                           draft_id=draft_id if use_hold else None)
+            db.session.commit()
+            results.put("booked")
+        except SeatUnavailable:
+            db.session.rollback()
+            results.put("seat taken")
+        except OperationalError:
+            # sqlite gave up waiting for the write lock, the booking was not saved
+            db.session.rollback()
+            results.put("database busy")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--database-url", help="defaults to a new sqlite file in a temp folder")
+    args = parser.parse_args()
+
+    database_url = args.database_url or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "seats.db")
+    os.environ["DATABASE_URL"] = database_url
+    sys.path.insert(0, ROOT)
+    from datetime import date, time
+    from app import app, db
+    from app.models import Booking, Flight, SeatHold
+    from app.admin_routes import calculateDuration
+    from app.seats import SEATS, seats_in
+
+    with app.app_context():
+        db.create_all()
+        day = date(2030, 1, 1)
+        flight = Flight(cityFrom="Sydney", cityTo="Dhaka", departDate=day, arrivalDate=day, departTime=time(10, 0), arrivalTime=time(14, 0),
+                        duration=calculateDuration(day, time(10, 0), day, time(14, 0)), fclass="Economy", price=100)
+        db.session.add(flight)
+        db.session.commit()
+        flight_num = flight.num
+
+    # spawn gives every worker its own interpreter and database connections, like separate gunicorn workers
+    context = multiprocessing.get_context("spawn")
+    failed = False
+    rounds = ("hold", "sell", "mixed")
+    for round_num in range(args.rounds):
+        for i, round_type in enumerate(rounds):
+            seat = SEATS[(round_num * len(rounds) + i) % len(SEATS)]
+            modes = [("sell", "hold only")[n % 2] if round_type == "mixed" else round_type for n in range(args.workers)]
+            barrier = context.Barrier(args.workers)
+            results = context.Queue()
+            processes = [context.Process(target=worker, args=(database_url, flight_num, seat, mode, barrier, results))
+                         for mode in modes]
+            for p in processes:
+                p.start()
+            for p in processes:
+                p.join()
+            outcomes = [results.get() for _ in processes]
+
+            with app.app_context():
+                bookings = Booking.query.filter_by(depart_flight_num=flight_num, seat=seat).count()
+                sold = seat in seats_in(db.session.get(Flight, flight_num).seatMap)
+                holds = SeatHold.query.filter_by(flight_num=flight_num, seat=seat).count()
+            if round_type == "mixed":
+                ok = (outcomes.count("booked") == bookings == 1 and sold and holds == 0) or \
+                     (outcomes.count("held") == holds == 1 and bookings == 0 and not sold)
+            else:
+                ok = outcomes.count("booked") == 1 and bookings == 1 and sold
+            failed = failed or not ok
+            summary = {outcome: outcomes.count(outcome) for outcome in set(outcomes)}
+            print(f"round {round_num + 1} {round_type} seat {seat}: {summary}, bookings in db: {bookings}, holds: {holds} -> {'OK' if ok else 'FAILED'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 from app import app, db
+from app.models import create_missing_indexes
 
 with app.app_context():
-    db.create_all()
\ No newline at end of file
+    db.create_all()
+    create_missing_indexes()
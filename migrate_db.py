@@ -0,0 +1,130 @@
+# upgrades an existing database to the current models.
+# every step checks what needs doing first, so this script can be run any number of times (ex: on every deploy).
+# new databases don't need this, create_db.py creates everything directly.
+from sqlalchemy import insert, inspect, text
+
+from app import app, db
+from app.bookings import generate_ref
+from app.models import create_missing_indexes, OutboxEvent
+from app.notifications import lookup_event_values
+from app.seats import seat_bit
+
+
+# flight dates/times used to be stored as strings ("2025-01-31", "10:30").
+# Postgres needs the column type changed. SQLite has no real column types, but the stored text must match the
+# format SQLAlchemy writes for Time ("10:30:00.000000"), otherwise comparing times would be wrong.
+def typed_flight_dates(connection):
+    if connection.dialect.name == "sqlite":
+        for column in ("departTime","arrivalTime"):
+            # "10:30" -> "10:30:00.000000" and "10:30:00" -> "10:30:00.000000"
+            update = text(f'UPDATE flight SET "{column}" = "{column}" || :suffix WHERE length("{column}") = :length')
+            connection.execute(update,{"suffix":":00.000000","length":5})
+            connection.execute(update,{"suffix":".000000","length":8})
+        return
+
+    columns = {c["name"]: c["type"] for c in inspect(connection).get_columns("flight")}
+    for column, new_type in (("departDate","DATE"),("arrivalDate","DATE"),("departTime","TIME"),("arrivalTime","TIME")):
+        if str(columns[column]).startswith("VARCHAR"):
+            connection.execute(text(f'ALTER TABLE flight ALTER COLUMN "{column}" TYPE {new_type} USING "{column}"::{new_type.lower()}'))
+
+
+# the route index was replaced by ix_flight_search, which also covers the flight class
+def drop_old_route_index(connection):
+    indexes = [i["name"] for i in inspect(connection).get_indexes("flight")]
+    if "ix_flight_route" in indexes:
+        connection.execute(text("DROP INDEX ix_flight_route"))
+
+
+# seat bitmap on flight. Seats of existing bookings are marked as sold.
+def flight_seat_map(connection):
+    columns = [c["name"] for c in inspect(connection).get_columns("flight")]
+    if "seatMap" in columns:
+        return
+    connection.execute(text('ALTER TABLE flight ADD COLUMN "seatMap" BIGINT NOT NULL DEFAULT 0'))
+    seat_maps = {}
+    for depart_num, return_num, seat in connection.execute(text("SELECT depart_flight_num, return_flight_num, seat FROM booking")):
+        for num in (depart_num, return_num):
+            if num is not None and seat_bit(seat):
+                seat_maps[num] = seat_maps.get(num, 0) | seat_bit(seat)
+    for num, seat_map in seat_maps.items():
+        connection.execute(text('UPDATE flight SET "seatMap" = :seat_map WHERE num = :num'), {"seat_map":seat_map,"num":num})
+
+
+# capacity and places sold on flight. Places sold are counted once from existing bookings (one per passenger),
+# after that the booking and cancel code keep the counter up to date.
+def flight_capacity(connection):
+    columns = [c["name"] for c in inspect(connection).get_columns("flight")]
+    if "seatsSold" in columns:
+        return
+    connection.execute(text('ALTER TABLE flight ADD COLUMN capacity INTEGER NOT NULL DEFAULT 20'))
+    connection.execute(text('ALTER TABLE flight ADD COLUMN "seatsSold" INTEGER NOT NULL DEFAULT 0'))
+    sold = text('''
+        SELECT b.depart_flight_num, b.return_flight_num, COUNT(bp.passenger_id)
+        FROM booking b JOIN booking_passenger bp ON bp.booking_id = b.id
+        GROUP BY b.id, b.depart_flight_num, b.return_flight_num''')
+    places = {}
+    for depart_num, return_num, count in connection.execute(sold):
+        for num in (depart_num, return_num):
+            if num is not None:
+                places[num] = places.get(num, 0) + count
+    for num, count in places.items():
+        # old flights could be overbooked, so capacity is raised to fit what was already sold
+        connection.execute(text('''UPDATE flight SET "seatsSold" = :count,
+            capacity = CASE WHEN capacity < :count THEN :count ELSE capacity END WHERE num = :num'''), {"count":count,"num":num})
+
+
+# link from flight to the recurring schedule it was created from (the schedule table itself is made by create_all)
+def flight_schedule(connection):
+    columns = [c["name"] for c in inspect(connection).get_columns("flight")]
+    if "schedule_id" in columns:
+        return
+    connection.execute(text("ALTER TABLE flight ADD COLUMN schedule_id INTEGER REFERENCES schedule (id)"))
+
+
+# booking refs used to be numbers from 100 to 10000 and are now random text (bookings.generate_ref).
+# old refs are kept as text, so customers can still use them. Old refs that were given to more than one booking
+# can't get the unique index, so the oldest booking keeps it and the others get a new ref, which is emailed to them.
+def booking_ref_text(connection):
+    columns = {c["name"]: c["type"] for c in inspect(connection).get_columns("booking")}
+    if str(columns["ref"]).startswith("VARCHAR"):
+        return
+    if connection.dialect.name == "sqlite":
+        # SQLite would keep returning the old values as numbers, so the column is replaced by a text one
+        connection.execute(text("ALTER TABLE booking ADD COLUMN ref_text VARCHAR(16) NOT NULL DEFAULT ''"))
+        connection.execute(text("UPDATE booking SET ref_text = CAST(ref AS TEXT)"))
+        connection.execute(text("ALTER TABLE booking DROP COLUMN ref"))
+        connection.execute(text("ALTER TABLE booking RENAME COLUMN ref_text TO ref"))
+    else:
+        connection.execute(text("ALTER TABLE booking ALTER COLUMN ref TYPE VARCHAR(16) USING ref::varchar"))
+    duplicates = connection.execute(text('''
+        SELECT id, email FROM booking b
+        WHERE id > (SELECT MIN(id) FROM booking WHERE ref = b.ref) ORDER BY id''')).all()
+    for booking_id, email in duplicates:
+        ref = generate_ref()
+        connection.execute(text("UPDATE booking SET ref = :ref WHERE id = :id"), {"ref":ref,"id":booking_id})
+        connection.execute(insert(OutboxEvent.__table__).values(lookup_event_values(email, [(booking_id, ref)])))
+    if duplicates:
+        print(f"  {len(duplicates)} bookings had a ref that was already used and got a new one")
+
+
+# steps run in this order. Add new steps at the end.
+STEPS = [
+    typed_flight_dates,
+    drop_old_route_index,
+    flight_seat_map,
+    flight_capacity,
+    flight_schedule,
+    booking_ref_text,
+]
+
+if __name__ == "__main__":
+    with app.app_context():
+        # new tables first, so later steps can rely on them
+        db.create_all()
+        # all steps run in one transaction, so a failed migration doesn't leave the database half converted
+        with db.engine.begin() as connection:
+            for step in STEPS:
+                print("Running", step.__name__)
+                step(connection)
+        create_missing_indexes()
+        print("Database is up to date.")